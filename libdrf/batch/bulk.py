@@ -0,0 +1,93 @@
+import json
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from django.urls.exceptions import Resolver404
+from rest_framework import status
+from rest_framework.response import Response
+
+from .renderers import unraw
+from .resolvers import resolver_cache
+from .utils import BULK_CREATE_KEY
+
+
+def get_bulk_key(spec):
+    """
+        Returns the key under which consecutive creates can be coalesced into a single
+        bulk create, or None if the view of the sub-request doesn't support it.
+    """
+    if spec["method"] != "post" or not isinstance(spec.get("body"), dict):
+        return None
+    path = urlsplit(spec["path"]).path
+    try:
+        match = resolver_cache.resolve(path)
+    except Resolver404:
+        return None
+    view_class = getattr(match.func, "view_class", None)
+    if not getattr(view_class, "batch_bulk_create", False):
+        return None
+    return json.dumps([spec["path"], spec.get("headers") or {}], sort_keys=True)
+
+
+def split_bulk_response(specs, indices, response):
+    """
+        Yields the (index, response) pairs of the creates in a coalesced bulk create.
+
+        A 207 response holds a result per item, any other response, e.g. a permission
+        error, applies to all of them.
+    """
+    if response["status_code"] != status.HTTP_207_MULTI_STATUS:
+        for index in indices:
+            yield index, dict(response, path=specs[index]["path"])
+        return
+
+    for index, result in zip(indices, unraw(response["body"])):
+        yield index, {
+            "status_code": result["status_code"],
+            "reason_phrase": HTTPStatus(result["status_code"]).phrase,
+            "body": result["body"],
+            "headers": response["headers"],
+            "path": specs[index]["path"],
+        }
+
+
+class BulkCreateMixin(object):
+
+    """
+        Lets the batch views coalesce consecutive creates to this view into a single
+        bulk_create, with COALESCE_BULK_CREATE enabled.
+
+        The items are validated one by one, the valid ones are then inserted together
+        and every item gets its own result. Like bulk_create, this doesn't call save()
+        or send the save signals, and only works for serializers whose validated data
+        are plain fields of the model.
+    """
+    batch_bulk_create = True
+
+    def create(self, request, *args, **kwargs):
+        if not request.META.get(BULK_CREATE_KEY):
+            return super().create(request, *args, **kwargs)
+        return self.bulk_create(request)
+
+    def bulk_create(self, request):
+        serializers = [self.get_serializer(data=item) for item in request.data]
+        valid = [serializer for serializer in serializers if serializer.is_valid()]
+        self.perform_bulk_create(valid)
+
+        results = []
+        for serializer in serializers:
+            if serializer.errors:
+                results.append(
+                    {"status_code": status.HTTP_400_BAD_REQUEST, "body": serializer.errors}
+                )
+            else:
+                results.append({"status_code": status.HTTP_201_CREATED, "body": serializer.data})
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    def perform_bulk_create(self, serializers):
+        model = self.get_queryset().model
+        instances = model._default_manager.bulk_create(
+            [model(**serializer.validated_data) for serializer in serializers]
+        )
+        for serializer, instance in zip(serializers, instances):
+            serializer.instance = instance
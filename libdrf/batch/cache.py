@@ -0,0 +1,94 @@
+import hashlib
+import json
+
+from django.core.cache import caches
+
+from .metrics import metrics
+from .settings import batch_settings
+from .transactions import SAFE_METHODS
+
+# Request headers identifying the user of a sub-request.
+USER_HEADERS = ["HTTP_AUTHORIZATION", "HTTP_COOKIE"]
+
+
+def get_write_epochs(specs):
+    """
+        Returns the number of unsafe sub-requests before each sub-request of a batch.
+    """
+    epochs = []
+    writes = 0
+    for spec in specs:
+        epochs.append(writes)
+        if spec["method"].upper() not in SAFE_METHODS:
+            writes += 1
+    return epochs
+
+
+def get_dedupe_key(spec, epoch=0):
+    """
+        Returns the key under which identical safe sub-request specs are executed
+        only once per batch, or None if the sub-request can't be deduplicated.
+
+        The epoch is the number of unsafe sub-requests before this one, so requests
+        with a write between them are never merged.
+    """
+    method = spec["method"].upper()
+    if method not in SAFE_METHODS or spec.get("body"):
+        return None
+    return json.dumps([epoch, method, spec["path"], spec.get("headers") or {}], sort_keys=True)
+
+
+def get_cache_timeout(wsgi_request, match):
+    """
+        Returns the number of seconds to cache the response of this sub-request for.
+
+        Views opt in to the cache with a `batch_cache_timeout` attribute, and can set
+        `batch_cache_per_user = False` to share the cached responses between users.
+    """
+    if match is None or wsgi_request.method not in SAFE_METHODS:
+        return None
+    view = getattr(match.func, "view_class", match.func)
+    return getattr(view, "batch_cache_timeout", None)
+
+
+def get_cache_key(wsgi_request, match, raw=False):
+    view = getattr(match.func, "view_class", match.func)
+    headers = list(batch_settings.CACHE_KEY_HEADERS)
+    if getattr(view, "batch_cache_per_user", True):
+        headers.extend(USER_HEADERS)
+    key = json.dumps([
+        wsgi_request.method,
+        wsgi_request.get_full_path(),
+        [wsgi_request.META.get(header) for header in headers],
+        raw,
+    ])
+    return "libdrf.batch.response:{}".format(hashlib.sha1(key.encode()).hexdigest())
+
+
+def get_response_cache():
+    return caches[batch_settings.RESPONSE_CACHE]
+
+
+def get_cached_response(key):
+    response = get_response_cache().get(key)
+    metrics.incr("response_cache.hits" if response is not None else "response_cache.misses")
+    return response
+
+
+async def aget_cached_response(key):
+    response = await get_response_cache().aget(key)
+    metrics.incr("response_cache.hits" if response is not None else "response_cache.misses")
+    return response
+
+
+def cache_response(key, response, timeout):
+    """
+        Cache a serialized sub-response, only successful ones are cached.
+    """
+    if response["status_code"] == 200:
+        get_response_cache().set(key, response, timeout)
+
+
+async def acache_response(key, response, timeout):
+    if response["status_code"] == 200:
+        await get_response_cache().aset(key, response, timeout)
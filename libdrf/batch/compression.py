@@ -0,0 +1,85 @@
+import re
+from gzip import GzipFile
+
+from django.utils.cache import patch_vary_headers
+from django.utils.text import StreamingBuffer, compress_sequence, compress_string
+
+from .settings import batch_settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPTS_BR_RE = re.compile(r"\bbr\b")
+ACCEPTS_GZIP_RE = re.compile(r"\bgzip\b")
+
+
+def get_encoding(request, streaming=False):
+    """
+        Returns the content encoding to use for the response to this request, or None.
+
+        Brotli is preferred when the brotli package is installed, streaming responses
+        are only compressed with gzip.
+    """
+    accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if brotli is not None and not streaming and ACCEPTS_BR_RE.search(accept_encoding):
+        return "br"
+    if ACCEPTS_GZIP_RE.search(accept_encoding):
+        return "gzip"
+    return None
+
+
+async def acompress_sequence(sequence):
+    """
+        Async counterpart of django.utils.text.compress_sequence, for the streaming
+        responses of async views.
+    """
+    buf = StreamingBuffer()
+    with GzipFile(mode="wb", compresslevel=6, fileobj=buf, mtime=0) as zfile:
+        # Output headers...
+        yield buf.read()
+        async for item in sequence:
+            zfile.write(item)
+            data = buf.read()
+            if data:
+                yield data
+    yield buf.read()
+
+
+def compress_response(request, response):
+    """
+        Compress a batch response with brotli or gzip, like Django's GZipMiddleware.
+    """
+    if response.has_header("Content-Encoding"):
+        return response
+    if not response.streaming and len(response.content) < batch_settings.COMPRESS_MIN_LENGTH:
+        return response
+
+    patch_vary_headers(response, ("Accept-Encoding",))
+    encoding = get_encoding(request, response.streaming)
+    if encoding is None:
+        return response
+
+    if response.streaming:
+        if response.is_async:
+            response.streaming_content = acompress_sequence(response.streaming_content)
+        else:
+            response.streaming_content = compress_sequence(response.streaming_content)
+        del response.headers["Content-Length"]
+    else:
+        if encoding == "br":
+            compressed = brotli.compress(response.content)
+        else:
+            compressed = compress_string(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(response.content))
+
+    # The compressed representation is different, see GZipMiddleware.
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response.headers["ETag"] = "W/" + etag
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,83 @@
+import logging
+
+from django.utils.cache import get_conditional_response, set_response_etag
+from django.utils.http import quote_etag
+
+from .settings import batch_settings
+
+logger = logging.getLogger(__name__)
+
+CONDITIONAL_METHODS = {"GET", "HEAD"}
+
+
+def get_version_function(wsgi_request, match):
+    """
+        Returns the `batch_version` of the view of a safe sub-request, if it has one.
+
+        `batch_version(request, *args, **kwargs)` is a cheap function, a static or class
+        method for class based views, returning a version of the resource, e.g. its
+        last modification time. When the client already has that version, the view
+        isn't called at all.
+
+        It runs before the view authenticates the request and checks permissions, so it
+        must not depend on the user. Only define it for resources whose version anyone
+        may learn, since clients find out whether their ETag is current.
+    """
+    if not batch_settings.ETAGS or match is None or wsgi_request.method not in CONDITIONAL_METHODS:
+        return None
+    view = getattr(match.func, "view_class", match.func)
+    return getattr(view, "batch_version", None)
+
+
+def get_version_etag(wsgi_request, match):
+    """
+        Returns the ETag from the `batch_version` of the view, if it has one. If it
+        fails, the view is called as usual.
+    """
+    version = get_version_function(wsgi_request, match)
+    if version is None:
+        return None
+    try:
+        value = version(wsgi_request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("Batch version of {} failed".format(match.view_name))
+        return None
+    return quote_etag(str(value)) if value is not None else None
+
+
+def get_not_modified(wsgi_request, etag):
+    """
+        Returns a 304 response if the If-None-Match header of the sub-request matches
+        the etag, otherwise None.
+    """
+    if not batch_settings.ETAGS or not etag or wsgi_request.method not in CONDITIONAL_METHODS:
+        return None
+    resp = get_conditional_response(wsgi_request, etag=etag)
+    if resp is not None:
+        resp["ETag"] = etag
+    return resp
+
+
+def conditional_response(wsgi_request, resp, etag=None):
+    """
+        Sets the ETag of a successful response to a safe sub-request, if the view didn't,
+        and returns a 304 response instead if it matches If-None-Match.
+
+        The ETag is the given etag, or else computed from the content like Django's
+        ConditionalGetMiddleware does.
+    """
+    if (
+        not batch_settings.ETAGS
+        or wsgi_request.method not in CONDITIONAL_METHODS
+        or resp.status_code != 200
+        or resp.streaming
+    ):
+        return resp
+    if hasattr(resp, "render"):
+        resp.render()
+    if not resp.has_header("ETag"):
+        if etag:
+            resp["ETag"] = etag
+        else:
+            set_response_etag(resp)
+    return get_conditional_response(wsgi_request, etag=resp["ETag"], response=resp)
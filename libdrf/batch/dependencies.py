@@ -0,0 +1,153 @@
+import re
+from urllib.parse import quote
+
+from .exceptions import FailedDependency
+from .renderers import RawJSON
+
+# Reference to a field of an earlier sub-response, e.g. `{result=0:$.body.id}`.
+REFERENCE_RE = re.compile(r"\{result=(\d+):\$((?:\.[^.{}/?&=]+)*)\}")
+
+
+def iter_strings(value):
+    """
+        Yields all the strings nested in a request body.
+    """
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_strings(item)
+
+
+def get_dependencies(spec):
+    """
+        Returns the indices of the sub-requests this request depends on, either
+        declared explicitly in `depends_on` or referenced in the path, headers or body.
+    """
+    dependencies = set(spec.get("depends_on", []))
+    strings = [spec["path"]]
+    strings.extend(iter_strings(spec.get("headers", {})))
+    strings.extend(iter_strings(spec.get("body")))
+    for string in strings:
+        dependencies.update(int(match.group(1)) for match in REFERENCE_RE.finditer(string))
+    return dependencies
+
+
+def get_layers(specs, indices=None):
+    """
+        Group the sub-requests into layers that can be executed in parallel.
+
+        Every request ends up in the layer after the last of its dependencies,
+        so each layer only depends on the layers before it. When only grouping
+        some of the indices, dependencies on the others are taken as done.
+    """
+    levels = {}
+    layers = []
+    for index in range(len(specs)) if indices is None else indices:
+        level = max(
+            (levels[dep] + 1 for dep in get_dependencies(specs[index]) if dep in levels),
+            default=0,
+        )
+        levels[index] = level
+        if level == len(layers):
+            layers.append([])
+        layers[level].append(index)
+    return layers
+
+
+def get_last_uses(specs):
+    """
+        Returns {index: index of the last request depending on it}.
+    """
+    last_uses = {}
+    for index, spec in enumerate(specs):
+        for dep in get_dependencies(spec):
+            last_uses[dep] = index
+    return last_uses
+
+
+def lookup(response, path):
+    """
+        Returns the value at the dotted path (e.g. `.body.items.0.id`) in a sub-response.
+    """
+    value = response
+    for key in path.split(".")[1:]:
+        if isinstance(value, RawJSON):
+            value = value.loads()
+        if isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        elif hasattr(value, "get") and key in value:
+            value = value[key]
+        else:
+            raise FailedDependency("Unresolved reference ${}".format(path))
+    if isinstance(value, RawJSON):
+        value = value.loads()
+    return value
+
+
+def to_string(value, path):
+    """
+        Returns a referenced value as a string, for use in a path or header. Raises
+        FailedDependency for values that have no sensible string form, like None or a dict.
+    """
+    if not isinstance(value, (str, int, float, bool)):
+        raise FailedDependency("Reference ${} is not a string or a number".format(path))
+    return str(value)
+
+
+def quote_path(value, path):
+    """
+        Returns a referenced value quoted for use in a path, so it can't change the
+        route or the query string of the sub-request.
+    """
+    return quote(to_string(value, path), safe="")
+
+
+def substitute(value, responses, convert=None):
+    """
+        Replace the references in a value. A string that consists of a single reference
+        is replaced by the referenced value itself, keeping its type, unless a convert
+        function is given. It is then applied to every referenced value.
+    """
+    def resolve(match, whole=False):
+        path = match.group(2)
+        referenced = lookup(responses[int(match.group(1))], path)
+        if convert is not None:
+            return convert(referenced, path)
+        return referenced if whole else str(referenced)
+
+    if isinstance(value, str):
+        match = REFERENCE_RE.fullmatch(value)
+        if match:
+            return resolve(match, whole=True)
+        return REFERENCE_RE.sub(resolve, value)
+    if isinstance(value, dict):
+        return {key: substitute(item, responses, convert) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [substitute(item, responses, convert) for item in value]
+    return value
+
+
+def resolve_references(spec, responses):
+    """
+        Returns a copy of the request spec with the references to earlier sub-responses
+        replaced by their values. Raises FailedDependency if a dependency did not succeed.
+    """
+    dependencies = get_dependencies(spec)
+    if not dependencies:
+        return spec
+
+    for dep in sorted(dependencies):
+        if responses[dep]["status_code"] >= 400:
+            raise FailedDependency("Request {} failed".format(dep))
+
+    spec = dict(spec)
+    spec["path"] = substitute(spec["path"], responses, quote_path)
+    if spec.get("headers"):
+        spec["headers"] = substitute(spec["headers"], responses, to_string)
+    if spec.get("body"):
+        spec["body"] = substitute(spec["body"], responses)
+    return spec
@@ -1,2 +1,34 @@
-class BadBatchRequest(Exception):
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class BadBatchRequest(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "Bad batch request."
+    default_code = "bad_batch_request"
+
+
+class FailedDependency(Exception):
     pass
+
+
+class BatchTimeout(Exception):
+    """
+        Raised by the executors when sub-requests didn't complete in time.
+    """
+
+    def __init__(self, indices):
+        super().__init__(indices)
+        self.indices = indices
+
+
+class IdempotencyConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A batch with this idempotency key is still being executed."
+    default_code = "idempotency_conflict"
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This idempotency key was already used for a different batch."
+    default_code = "idempotency_key_reused"
@@ -1,17 +1,121 @@
+import asyncio
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from concurrent.futures.thread import ThreadPoolExecutor
 from concurrent.futures.process import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from django.db import close_old_connections, connections
+from django.urls import Resolver404
+
+from .exceptions import BatchTimeout
+from .metrics import metrics
+from .renderers import unraw
+
+# Seconds between checks for futures of which the executor can't tell when they started.
+POLL_INTERVAL = 0.01
+
+
+def get_started(future, now):
+    '''
+        Returns the time.monotonic() at which the task of a future started running, or None.
+
+        Thread based executors record it in the worker, in `future.started`. For other
+        futures it is the first time they are seen running.
+    '''
+    started = getattr(future, "started", None)
+    if started is None and future.running():
+        started = future.started = [now]
+    return started[0] if started else None
+
+
+def wait_next(futures, deadline=None, item_timeout=None):
+    '''
+        Waits for the first of the futures to complete, or to run for longer than
+        item_timeout seconds. Returns the futures that are done and the ones that
+        timed out. Raises BatchTimeout with the indices of all the futures when the
+        deadline passes first.
+    '''
+    while True:
+        now = time.monotonic()
+        done = {future for future in futures if future.done()}
+        if done:
+            return done, set()
+        if deadline is not None and now >= deadline:
+            raise BatchTimeout(sorted(futures.values()))
+
+        expired = set()
+        wakeups = [deadline] if deadline is not None else []
+        if item_timeout is not None:
+            for future in futures:
+                started = get_started(future, now)
+                if started is None:
+                    wakeups.append(now + POLL_INTERVAL)
+                elif started + item_timeout <= now:
+                    expired.add(future)
+                else:
+                    wakeups.append(started + item_timeout)
+        if expired:
+            return set(), expired
+
+        timeout = max(min(wakeups) - now, 0) if wakeups else None
+        wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
 
 
 class Executor(object):
 
+    def submit(self, resp_generator, request, *args, **kwargs):
+        '''
+            Schedules the resp_generator for a single request on the pool and returns its future.
+        '''
+        return self.executor_pool.submit(resp_generator, request, *args, **kwargs)
+
     def execute(self, requests, resp_generator, *args, **kwargs):
         '''
             Calls the resp_generator for all the requests in parallel in an asynchronous way.
         '''
-        result_futures = [self.executor_pool.submit(resp_generator, req, *args, **kwargs) for req in requests]
+        result_futures = [self.submit(resp_generator, req, *args, **kwargs) for req in requests]
         resp = [res_future.result() for res_future in result_futures]
         return resp
 
+    def execute_as_completed(
+        self, requests, resp_generator, *args, timeout=None, item_timeout=None, **kwargs
+    ):
+        '''
+            Calls the resp_generator for all the requests in parallel and yields (index, response)
+            pairs in the order the responses complete.
+
+            A request still running item_timeout seconds after it started is abandoned,
+            and (index, BatchTimeout) is yielded for it instead of a response. If they are
+            not all done within timeout seconds, the queued ones are cancelled and
+            BatchTimeout is raised with the indices of the unfinished requests.
+        '''
+        result_futures = {
+            self.submit(resp_generator, req, *args, **kwargs): index
+            for index, req in enumerate(requests)
+        }
+        yield from self.iter_completed(result_futures, timeout, item_timeout)
+
+    def iter_completed(self, result_futures, timeout=None, item_timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        pending = dict(result_futures)
+        try:
+            while pending:
+                done, expired = wait_next(pending, deadline, item_timeout)
+                for res_future in expired:
+                    index = pending.pop(res_future)
+                    yield index, BatchTimeout([index])
+                for res_future in done:
+                    yield pending.pop(res_future), res_future.result()
+        finally:
+            # Free the workers from the requests that can't be used anymore.
+            for res_future in result_futures:
+                res_future.cancel()
+
 
 class SequentialExecutor(Executor):
     '''
@@ -22,26 +126,526 @@ class SequentialExecutor(Executor):
         '''
             Calls the resp_generator for all the requests in sequential order.
         '''
-        return [resp_generator(request) for request in requests]
+        return [resp_generator(request, *args, **kwargs) for request in requests]
+
+    def execute_as_completed(
+        self, requests, resp_generator, *args, timeout=None, item_timeout=None, **kwargs
+    ):
+        '''
+            Calls the resp_generator for all the requests in sequential order, yielding each
+            (index, response) pair as soon as it is done.
+
+            A running request can't be interrupted, once the timeout has passed the remaining
+            requests are skipped and BatchTimeout is raised with their indices. For the
+            same reason item_timeout isn't enforced.
+        '''
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for index, request in enumerate(requests):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise BatchTimeout(list(range(index, len(requests))))
+            yield index, resp_generator(request, *args, **kwargs)
 
 
 class ThreadBasedExecutor(Executor):
     '''
         An implementation of executor using threads for parallelism.
+
+        Every worker thread holds its own database connections. They are managed
+        like Django does for requests: close_old_connections runs before and after
+        every task, so CONN_MAX_AGE and CONN_HEALTH_CHECKS are honoured and broken
+        or expired connections are not reused.
     '''
-    def __init__(self, num_workers):
+    def __init__(self, num_workers, max_db_workers=None):
         '''
             Create a thread pool for concurrent execution with specified number of workers.
+
+            Each worker may keep a connection per database open. max_db_workers bounds
+            the number of workers using the database at the same time, and so the number
+            of connections, independently of num_workers: tasks wait for one of
+            max_db_workers slots, and close their connections when they give it up.
+            Sub-requests to views with `batch_uses_database = False` don't take a slot.
+        '''
+        self.num_workers = num_workers
+        self.db_slots = threading.BoundedSemaphore(max_db_workers) if max_db_workers else None
+        self.open_connections = {}
+        self.lock = threading.Lock()
+        self.executor_pool = self.create_pool()
+
+    def create_pool(self):
+        return ThreadPoolExecutor(self.num_workers, thread_name_prefix="batch")
+
+    def submit(self, resp_generator, request, *args, **kwargs):
+        started = []
+        future = self.executor_pool.submit(
+            self.run_started, started, resp_generator, request, *args, **kwargs
+        )
+        future.started = started
+        return future
+
+    def run_started(self, started, resp_generator, request, *args, **kwargs):
+        started.append(time.monotonic())
+        return self.run(resp_generator, request, *args, **kwargs)
+
+    def run(self, resp_generator, request, *args, **kwargs):
+        '''
+            Runs a task on a worker thread, within the same connection lifecycle as a request.
+        '''
+        try:
+            with self.db_slot(request):
+                close_old_connections()
+                try:
+                    return resp_generator(request, *args, **kwargs)
+                finally:
+                    close_old_connections()
+        finally:
+            self.update_connection_gauge()
+
+    def uses_database(self, request):
+        '''
+            Returns whether the task for a request may use the database.
+        '''
+        from .resolvers import resolver_cache
+        from .transactions import uses_database
+        try:
+            match = resolver_cache.resolve(request.path_info)
+        except Resolver404:
+            return False
+        except Exception:
+            return True
+        return uses_database(match.func)
+
+    @contextmanager
+    def db_slot(self, request):
+        '''
+            Holds one of the max_db_workers slots while a task that may use the database runs.
+        '''
+        if self.db_slots is None or not self.uses_database(request):
+            yield
+            return
+        with self.db_slots:
+            try:
+                yield
+            finally:
+                # Other workers may take the slot, don't keep the connections open.
+                connections.close_all()
+
+    def update_connection_gauge(self):
+        worker = threading.current_thread().name
+        count = sum(1 for conn in connections.all() if conn.connection is not None)
+        with self.lock:
+            self.open_connections[worker] = count
+        metrics.gauge("db_connections.{}".format(worker), count)
+
+    def connection_gauges(self):
+        '''
+            Returns the number of open database connections per worker thread.
+        '''
+        with self.lock:
+            return dict(self.open_connections)
+
+
+class AdaptiveExecutor(ThreadBasedExecutor):
+    '''
+        Thread based executor that decides per batch whether to fan out, and how wide.
+
+        It keeps an exponentially weighted moving average of the latency of every view.
+        Batches that are expected to take less than inline_threshold seconds run inline,
+        on the calling thread, since handing them to the pool costs more than it saves.
+        Others are spread over just enough workers to finish in about the time of the
+        slowest sub-request.
+
+        Select it with EXECUTE_PARALLEL and
+        CONCURRENT_EXECUTOR = "libdrf.batch.executors.AdaptiveExecutor".
+    '''
+    def __init__(self, num_workers, max_db_workers=None, inline_threshold=0.005,
+                 default_latency=0.01, alpha=0.2):
+        super().__init__(num_workers, max_db_workers)
+        self.inline_threshold = inline_threshold
+        self.default_latency = default_latency
+        self.alpha = alpha
+        self.latencies = {}
+
+    def get_view_key(self, request):
+        '''
+            Returns the name of the view the request resolves to, to keep statistics per view.
+        '''
+        from .resolvers import resolver_cache
+        try:
+            return resolver_cache.resolve(request.path_info).view_name
+        except Exception:
+            return request.path_info
+
+    def record_latency(self, key, elapsed):
+        with self.lock:
+            latency = self.latencies.get(key)
+            if latency is None:
+                self.latencies[key] = elapsed
+            else:
+                self.latencies[key] = latency + self.alpha * (elapsed - latency)
+
+    def expected_latency(self, key):
+        with self.lock:
+            return self.latencies.get(key, self.default_latency)
+
+    def get_width(self, keys):
+        '''
+            Returns the number of workers to run the batch on, 0 to run it inline.
+        '''
+        estimates = [self.expected_latency(key) for key in keys]
+        total = sum(estimates)
+        if len(estimates) <= 1 or total <= self.inline_threshold:
+            return 0
+        return min(self.num_workers, len(estimates), math.ceil(total / max(estimates)))
+
+    def timed(self, key, resp_generator):
+        def run(request, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return resp_generator(request, *args, **kwargs)
+            finally:
+                self.record_latency(key, time.perf_counter() - start)
+        return run
+
+    def execute(self, requests, resp_generator, *args, **kwargs):
+        results = dict(self.execute_as_completed(requests, resp_generator, *args, **kwargs))
+        return [results[index] for index in range(len(requests))]
+
+    def execute_as_completed(
+        self, requests, resp_generator, *args, timeout=None, item_timeout=None, **kwargs
+    ):
+        '''
+            Same as Executor.execute_as_completed. Inline batches can't enforce item_timeout.
+        '''
+        keys = [self.get_view_key(request) for request in requests]
+        width = self.get_width(keys)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        if not width:
+            metrics.incr("adaptive.inline")
+            for index, request in enumerate(requests):
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise BatchTimeout(list(range(index, len(requests))))
+                yield index, self.timed(keys[index], resp_generator)(request, *args, **kwargs)
+            return
+
+        # Keep at most width sub-requests of this batch in flight.
+        metrics.incr("adaptive.parallel")
+        pending = list(enumerate(requests))
+        in_flight = {}
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < width:
+                    index, request = pending.pop(0)
+                    future = self.submit(
+                        self.timed(keys[index], resp_generator), request, *args, **kwargs
+                    )
+                    in_flight[future] = index
+                try:
+                    done, expired = wait_next(in_flight, deadline, item_timeout)
+                except BatchTimeout as exc:
+                    raise BatchTimeout(sorted(
+                        exc.indices + [index for index, request in pending]
+                    ))
+                for future in expired:
+                    index = in_flight.pop(future)
+                    yield index, BatchTimeout([index])
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+class BatchQueue(object):
+    '''
+        The queued tasks of a batch in a FairExecutor and the number of them running.
+    '''
+    def __init__(self):
+        self.tasks = deque()
+        self.running = 0
+
+
+class FairExecutor(ThreadBasedExecutor):
+    '''
+        Thread based executor that shares its workers fairly between concurrent batches.
+
+        Instead of a single FIFO queue, every batch gets its own queue. The workers take
+        tasks from the batches round robin and run at most max_per_batch tasks of a
+        batch at the same time, so a large batch of slow sub-requests can't hold up the
+        batches behind it.
+    '''
+    def __init__(self, num_workers, max_db_workers=None, max_per_batch=4):
+        self.max_per_batch = max_per_batch
+        self.condition = threading.Condition()
+        self.queues = deque()
+        self.workers = []
+        super().__init__(num_workers, max_db_workers)
+
+    def create_pool(self):
+        # The workers are started on first use, and take their tasks from the queues.
+        return None
+
+    def start_workers(self):
+        if self.workers:
+            return
+        for number in range(self.num_workers):
+            worker = threading.Thread(
+                target=self.work, name="batch_{}".format(number), daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def queue_depth(self):
+        '''
+            Returns the number of tasks waiting for a worker.
+        '''
+        with self.condition:
+            return sum(len(queue.tasks) for queue in self.queues)
+
+    def update_queue_gauges(self):
+        metrics.gauge("fair.queue_depth", sum(len(queue.tasks) for queue in self.queues))
+        metrics.gauge("fair.batches", len(self.queues))
+
+    def next_task(self):
         '''
-        self.executor_pool = ThreadPoolExecutor(num_workers)
+            Takes the next task, round robin over the batches with tasks to run and room
+            under max_per_batch. Must be called with the condition held.
+        '''
+        for _ in range(len(self.queues)):
+            queue = self.queues[0]
+            self.queues.rotate(-1)
+            if queue.tasks and queue.running < self.max_per_batch:
+                queue.running += 1
+                task = queue.tasks.popleft()
+                if not queue.tasks:
+                    self.queues.remove(queue)
+                self.update_queue_gauges()
+                return queue, task
+        return None, None
+
+    def work(self):
+        while True:
+            with self.condition:
+                queue, task = self.next_task()
+                while task is None:
+                    self.condition.wait()
+                    queue, task = self.next_task()
+
+            future, resp_generator, request, args, kwargs, queued_at = task
+            if future.set_running_or_notify_cancel():
+                future.started.append(time.monotonic())
+                metrics.observe("fair.wait", time.perf_counter() - queued_at)
+                try:
+                    result = self.run(resp_generator, request, *args, **kwargs)
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+
+            with self.condition:
+                queue.running -= 1
+                self.condition.notify_all()
+
+    def execute(self, requests, resp_generator, *args, **kwargs):
+        results = dict(self.execute_as_completed(requests, resp_generator, *args, **kwargs))
+        return [results[index] for index in range(len(requests))]
+
+    def enqueue(self, requests, resp_generator, args, kwargs):
+        '''
+            Queues the requests as a batch of their own and returns the queue and the
+            futures of the requests.
+        '''
+        queue = BatchQueue()
+        futures = []
+        queued_at = time.perf_counter()
+        for request in requests:
+            future = Future()
+            future.started = []
+            queue.tasks.append((future, resp_generator, request, args, kwargs, queued_at))
+            futures.append(future)
+        if not futures:
+            return queue, futures
+
+        with self.condition:
+            self.start_workers()
+            # A new batch waits for its turn, new batches can't hold up the earlier ones.
+            self.queues.append(queue)
+            self.update_queue_gauges()
+            self.condition.notify_all()
+        return queue, futures
+
+    def submit(self, resp_generator, request, *args, **kwargs):
+        queue, futures = self.enqueue([request], resp_generator, args, kwargs)
+        return futures[0]
+
+    def execute_as_completed(
+        self, requests, resp_generator, *args, timeout=None, item_timeout=None, **kwargs
+    ):
+        queue, futures = self.enqueue(requests, resp_generator, args, kwargs)
+        if not futures:
+            return
+        futures = {future: index for index, future in enumerate(futures)}
+
+        try:
+            yield from self.iter_completed(futures, timeout, item_timeout)
+        finally:
+            # Drop the tasks that didn't start yet if the batch is abandoned or timed out.
+            with self.condition:
+                for task in queue.tasks:
+                    task[0].cancel()
+                queue.tasks.clear()
+                if queue in self.queues:
+                    self.queues.remove(queue)
+                self.update_queue_gauges()
+
+
+def init_process_worker():
+    '''
+        Prepares a worker process of the ProcessBasedExecutor.
+    '''
+    import django
+    from django.apps import apps
+    from django.urls import get_resolver
+
+    if not apps.ready:
+        django.setup()
+    # Connections inherited from a forked parent must not be used, nor closed.
+    for conn in connections.all():
+        conn.connection = None
+    # Load the URLconf once, instead of in the first sub-request.
+    get_resolver()._populate()
+
+
+def run_request_spec(resp_generator, spec, *args, **kwargs):
+    '''
+        Calls the resp_generator in a worker process for the request described by spec.
+    '''
+    from .utils import get_request_from_spec
+    return resp_generator(get_request_from_spec(spec), *args, **kwargs)
 
 
 class ProcessBasedExecutor(Executor):
     '''
         An implementation of executor using process(es) for parallelism.
+
+        The sub-requests are sent to the workers as picklable RequestSpecs and the
+        sub-responses come back with their bodies already rendered. The resp_generator
+        must be a module level function taking a raw argument, like
+        views.get_deserialized_response.
     '''
-    def __init__(self, num_workers):
+    def __init__(self, num_workers, mp_context=None):
         '''
             Create a process pool for concurrent execution with specified number of workers.
+
+            mp_context is the multiprocessing start method of the workers, e.g. "spawn".
         '''
-        self.executor_pool = ProcessPoolExecutor(num_workers)
+        if mp_context is not None:
+            mp_context = multiprocessing.get_context(mp_context)
+        self.executor_pool = ProcessPoolExecutor(
+            num_workers, mp_context=mp_context, initializer=init_process_worker
+        )
+
+    def submit(self, resp_generator, request, *args, **kwargs):
+        from .utils import get_request_spec
+        return self.executor_pool.submit(
+            run_request_spec, resp_generator, get_request_spec(request), *args, **kwargs
+        )
+
+    def execute(self, requests, resp_generator, *args, **kwargs):
+        results = dict(self.execute_as_completed(requests, resp_generator, *args, **kwargs))
+        return [results[index] for index in range(len(requests))]
+
+    def execute_as_completed(self, requests, resp_generator, *args, raw=False, **kwargs):
+        '''
+            Same as Executor.execute_as_completed. The bodies are always rendered in the
+            workers, and only parsed here if raw responses weren't asked for.
+        '''
+        for index, response in super().execute_as_completed(
+            requests, resp_generator, *args, raw=True, **kwargs
+        ):
+            if not raw:
+                response = dict(response, body=unraw(response["body"]))
+            yield index, response
+
+
+class AsyncExecutor(Executor):
+    '''
+        An implementation of executor using asyncio tasks on the running event loop.
+    '''
+    def __init__(self, num_workers):
+        '''
+            Limit the number of sub-requests awaited concurrently to num_workers.
+        '''
+        self.num_workers = num_workers
+
+    async def execute(self, requests, resp_generator, *args, **kwargs):
+        '''
+            Awaits the resp_generator coroutine for all the requests, keeping the submission order.
+        '''
+        semaphore = asyncio.Semaphore(self.num_workers)
+
+        async def run(request):
+            async with semaphore:
+                return await resp_generator(request, *args, **kwargs)
+
+        return list(await asyncio.gather(*[run(request) for request in requests]))
+
+    async def execute_as_completed(
+        self, requests, resp_generator, *args, timeout=None, item_timeout=None, **kwargs
+    ):
+        '''
+            Awaits the resp_generator coroutine for all the requests and yields (index, response)
+            pairs in the order the responses complete.
+
+            A request still running item_timeout seconds after it started is cancelled, and
+            (index, BatchTimeout) is yielded for it. The requests still running after
+            timeout seconds are cancelled and BatchTimeout is raised with their indices.
+        '''
+        semaphore = asyncio.Semaphore(self.num_workers)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        started = {}
+
+        async def run(index, request):
+            async with semaphore:
+                started[index] = time.monotonic()
+                return await resp_generator(request, *args, **kwargs)
+
+        tasks = {
+            asyncio.ensure_future(run(index, request)): index
+            for index, request in enumerate(requests)
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                now = time.monotonic()
+                expired = set()
+                wakeups = [deadline] if deadline is not None else []
+                if item_timeout is not None:
+                    for task in pending:
+                        index = tasks[task]
+                        if task.done():
+                            wakeups.append(now)
+                        elif index not in started:
+                            wakeups.append(now + POLL_INTERVAL)
+                        elif started[index] + item_timeout <= now:
+                            expired.add(task)
+                        else:
+                            wakeups.append(started[index] + item_timeout)
+                for task in expired:
+                    task.cancel()
+                    pending.discard(task)
+                    yield tasks[task], BatchTimeout([tasks[task]])
+                if expired:
+                    continue
+
+                remaining = max(min(wakeups) - now, 0) if wakeups else None
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done and deadline is not None and time.monotonic() >= deadline:
+                    raise BatchTimeout(sorted(tasks[task] for task in pending))
+                for task in done:
+                    yield tasks[task], task.result()
+        finally:
+            for task in pending:
+                task.cancel()
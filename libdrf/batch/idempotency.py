@@ -0,0 +1,148 @@
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.utils.encoders import JSONEncoder
+
+from .exceptions import IdempotencyConflict, IdempotencyKeyReused
+from .metrics import metrics
+from .settings import batch_settings, import_class
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# Seconds between checks while waiting for an in-flight duplicate.
+POLL_INTERVAL = 0.05
+
+
+class CacheBackend(object):
+
+    """
+        Stores the idempotency records in the IDEMPOTENCY_CACHE. The cache has to be
+        shared between the processes serving the batches, and support an atomic add(),
+        e.g. Redis or Memcached.
+
+        Other backends, e.g. a database table, implement the same four methods.
+    """
+
+    def __init__(self):
+        self.cache = caches[batch_settings.IDEMPOTENCY_CACHE]
+
+    def add(self, key, record, timeout):
+        """
+            Store the record unless the key exists, returns whether it was stored.
+        """
+        return self.cache.add(key, record, timeout)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, record, timeout):
+        self.cache.set(key, record, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+def get_backend():
+    return import_class(batch_settings.IDEMPOTENCY_BACKEND)()
+
+
+def get_idempotency_key(request):
+    """
+        Returns the key to store the response of this batch under, or None if the
+        client didn't send an idempotency key. Keys are scoped to the authenticated
+        user, or for anonymous clients to their Authorization header and session, and
+        to the format of the response.
+    """
+    value = batch_settings.IDEMPOTENCY_HEADER and request.META.get(batch_settings.IDEMPOTENCY_HEADER)
+    if not value:
+        return None
+    user = request.user
+    if user is not None and user.is_authenticated:
+        client = ["user", user.pk]
+    else:
+        client = [
+            "anonymous",
+            request.META.get("HTTP_AUTHORIZATION"),
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME),
+        ]
+    key = json.dumps([value, client, request.accepted_renderer.format])
+    return "libdrf.batch.idempotency:{}".format(hashlib.sha1(key.encode()).hexdigest())
+
+
+def get_fingerprint(data):
+    """
+        Returns a hash of the batch payload, to detect keys reused for another batch.
+    """
+    payload = json.dumps(data, cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+@contextmanager
+def keep_locked(key, record, timeout):
+    """
+        Refresh the lock of a key every third of its timeout until the block exits,
+        so it doesn't expire under a batch that runs longer than the timeout. The
+        lock still expires if the process dies.
+    """
+    done = threading.Event()
+
+    def refresh():
+        # Cache connections are per thread.
+        backend = get_backend()
+        while not done.wait(timeout / 3):
+            backend.set(key, record, timeout)
+
+    thread = threading.Thread(target=refresh, name="idempotency_lock", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def execute_once(key, fingerprint, execute):
+    """
+        Returns the stored (data, status_code) of the batch with this key, or calls
+        execute() to get them and stores them for IDEMPOTENCY_TTL seconds.
+
+        While a batch is in flight its key is locked, and the lock is refreshed for
+        as long as it executes. Duplicates wait for it to be stored for up to
+        IDEMPOTENCY_LOCK_TIMEOUT seconds and then raise IdempotencyConflict. Nothing is stored when execute() raises or returns a
+        server error, so the batch can be retried.
+
+        Returns ((data, status_code), replayed).
+    """
+    backend = get_backend()
+    lock_timeout = batch_settings.IDEMPOTENCY_LOCK_TIMEOUT
+    deadline = time.monotonic() + lock_timeout
+    lock = {"fingerprint": fingerprint}
+    while not backend.add(key, lock, lock_timeout):
+        record = backend.get(key)
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReused()
+            if "response" in record:
+                metrics.incr("idempotency.replays")
+                return record["response"], True
+        if time.monotonic() >= deadline:
+            raise IdempotencyConflict()
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        with keep_locked(key, lock, lock_timeout):
+            data, status_code = execute()
+    except BaseException:
+        backend.delete(key)
+        raise
+    if status_code >= 500:
+        backend.delete(key)
+    else:
+        record = {"fingerprint": fingerprint, "response": (data, status_code)}
+        backend.set(key, record, batch_settings.IDEMPOTENCY_TTL)
+    return (data, status_code), False
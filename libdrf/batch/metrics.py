@@ -0,0 +1,54 @@
+import threading
+from collections import namedtuple
+
+Timer = namedtuple("Timer", ["count", "total", "max"])
+
+
+class Metrics(object):
+
+    """
+        Thread safe counters, gauges and timers of the batch machinery.
+
+        Read them with snapshot(), e.g. from a monitoring view or a periodic task.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.timers = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        """
+            Record a duration, in seconds.
+        """
+        with self.lock:
+            count, total, maximum = self.timers.get(name, (0, 0.0, 0.0))
+            self.timers[name] = Timer(count + 1, total + value, max(maximum, value))
+
+    def get_timer(self, name):
+        with self.lock:
+            return self.timers.get(name)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timers": {name: timer._asdict() for name, timer in self.timers.items()},
+            }
+
+
+metrics = Metrics()
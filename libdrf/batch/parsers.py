@@ -0,0 +1,40 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .renderers import msgpack
+from .utils import BATCH_DATA_ATTR
+
+
+class BatchJSONParser(JSONParser):
+    """
+        JSON parser that accepts the already parsed body of batch sub-requests.
+
+        Use it in place of JSONParser (e.g. in DEFAULT_PARSER_CLASSES) to skip
+        decoding sub-request bodies a second time. Parser selection and content
+        type handling are the same as for JSONParser, other requests are parsed
+        as usual.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        http_request = getattr(request, "_request", None)
+        if hasattr(http_request, BATCH_DATA_ATTR):
+            return getattr(http_request, BATCH_DATA_ATTR)
+        return super().parse(stream, media_type, parser_context)
+
+
+class MsgPackParser(BaseParser):
+    """
+        Parses MessagePack batch requests. Requires the msgpack package.
+    """
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as exc:
+            raise ParseError("MessagePack parse error - {}".format(exc))
+
+
+# Parsers accepted by the batch views when their dependencies are installed.
+OPTIONAL_PARSERS = [MsgPackParser] if msgpack is not None else []
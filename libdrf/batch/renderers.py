@@ -0,0 +1,111 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class RawJSON(bytes):
+    """
+        An already rendered JSON document, e.g. the content of a sub-response.
+    """
+
+    def loads(self):
+        return json.loads(self)
+
+
+def unraw(data):
+    """
+        Replace the RawJSON documents nested in data with their parsed values.
+    """
+    if isinstance(data, RawJSON):
+        return data.loads()
+    if isinstance(data, dict):
+        return {key: unraw(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [unraw(value) for value in data]
+    return data
+
+
+class BatchJSONRenderer(JSONRenderer):
+    """
+        Renders batch responses as JSON.
+
+        RawJSON sub-response bodies are spliced into the output as is, instead of
+        being decoded and encoded again.
+    """
+
+    def render_value(self, value):
+        if isinstance(value, RawJSON):
+            return bytes(value)
+        if value is None:
+            return b"null"
+        return super().render(value)
+
+    def render_item(self, item):
+        return b"{" + b",".join(
+            self.render_value(key) + b":" + self.render_value(value)
+            for key, value in item.items()
+        ) + b"}"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, dict) or not isinstance(data.get("responses"), list):
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(unraw(data), accepted_media_type, renderer_context)
+
+        parts = []
+        for key, value in data.items():
+            if key == "responses":
+                rendered = b"[" + b",".join(self.render_item(item) for item in value) + b"]"
+            else:
+                rendered = self.render_value(value)
+            parts.append(self.render_value(key) + b":" + rendered)
+        return b"{" + b",".join(parts) + b"}"
+
+
+class NDJSONRenderer(BatchJSONRenderer):
+    """
+        Renders newline delimited JSON, one JSON document per line.
+
+        Used by the batch views to stream sub-responses as they complete.
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render_line(self, data):
+        if isinstance(data, dict):
+            return self.render_item(data) + b"\n"
+        return self.render_value(data) + b"\n"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if isinstance(data, (list, tuple)):
+            return b"".join(self.render_line(item) for item in data)
+        return self.render_line(data)
+
+
+class MsgPackRenderer(BaseRenderer):
+    """
+        Renders batch responses as MessagePack. Requires the msgpack package.
+    """
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(unraw(data), default=JSONEncoder().default, use_bin_type=True)
+
+
+# Renderers offered by the batch views when their dependencies are installed.
+OPTIONAL_RENDERERS = [MsgPackRenderer] if msgpack is not None else []
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.urls import get_resolver, get_urlconf
+
+from .settings import batch_settings
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class ResolverCache(object):
+
+    """
+        Bounded LRU cache of path -> ResolverMatch for batch sub-requests.
+
+        Entries are kept per URLconf together with the resolver they came from.
+        When the URLconfs are reloaded (clear_url_caches, e.g. on ROOT_URLCONF
+        changes) Django creates a new resolver and the stale entries are dropped.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self._caches = {}
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self):
+        with self.lock:
+            currsize = sum(len(entries) for resolver, entries in self._caches.values())
+            return CacheInfo(self.hits, self.misses, self.maxsize, currsize)
+
+    def _get_entries(self, urlconf):
+        resolver = get_resolver(urlconf)
+        cached_resolver, entries = self._caches.get(urlconf, (None, None))
+        if cached_resolver is not resolver:
+            entries = OrderedDict()
+            self._caches[urlconf] = (resolver, entries)
+        return resolver, entries
+
+    def resolve(self, path):
+        """
+            Same as django.urls.resolve, raises Resolver404 if no view matches.
+        """
+        urlconf = get_urlconf()
+        if not self.maxsize:
+            return get_resolver(urlconf).resolve(path)
+
+        with self.lock:
+            resolver, entries = self._get_entries(urlconf)
+            match = entries.get(path)
+            if match is not None:
+                entries.move_to_end(path)
+                self.hits += 1
+                return match
+            self.misses += 1
+
+        match = resolver.resolve(path)
+
+        with self.lock:
+            entries[path] = match
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        return match
+
+
+resolver_cache = ResolverCache(batch_settings.RESOLVE_CACHE_SIZE)
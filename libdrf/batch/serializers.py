@@ -1,5 +1,8 @@
 from rest_framework import serializers
 
+from .dependencies import get_dependencies
+from .transactions import TRANSACTION_MODES
+
 
 class BatchRequestItemSerializer(serializers.Serializer):
     path = serializers.CharField()
@@ -18,7 +21,8 @@ class BatchRequestItemSerializer(serializers.Serializer):
         ]
     )
     body = serializers.DictField(required=False)
-    headers = serializers.DictField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(allow_blank=True), required=False)
+    depends_on = serializers.ListField(child=serializers.IntegerField(min_value=0), required=False)
 
     def validate_method(self, method):
         return method.lower()
@@ -26,9 +30,24 @@ class BatchRequestItemSerializer(serializers.Serializer):
 
 class BatchRequestSerializer(serializers.Serializer):
     requests = BatchRequestItemSerializer(many=True)
+    transaction = serializers.ChoiceField(choices=TRANSACTION_MODES, required=False)
+
+    def validate_requests(self, requests):
+        for index, request in enumerate(requests):
+            if any(dep >= index for dep in get_dependencies(request)):
+                raise serializers.ValidationError(
+                    "Request {} can only depend on earlier requests.".format(index)
+                )
+        return requests
+
+
+class BatchTemplateRequestSerializer(serializers.Serializer):
+    template = serializers.CharField()
+    params = serializers.DictField(required=False)
 
 
 class BatchResponseItemSerializer(serializers.Serializer):
+    index = serializers.IntegerField(required=False)
     status_code = serializers.IntegerField()
     reason_phrase = serializers.CharField()
     body = serializers.JSONField()
@@ -37,4 +56,5 @@ class BatchResponseItemSerializer(serializers.Serializer):
 
 
 class BatchResponseSerializer(serializers.Serializer):
+    headers = serializers.DictField(required=False)
     responses = BatchResponseItemSerializer(many=True)
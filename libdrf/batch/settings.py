@@ -10,9 +10,39 @@ DEFAULTS = {
     "EXECUTE_PARALLEL": False,
     "CONCURRENT_EXECUTOR": "libdrf.batch.executors.ThreadBasedExecutor",
     "NUM_WORKERS": multiprocessing.cpu_count() * 4,
+    "EXECUTOR_OPTIONS": {},
     "ADD_DURATION_HEADER": True,
+    "SERVER_TIMING": False,
     "DURATION_HEADER_NAME": "libdrf.batch.duration",
     "MAX_LIMIT": 20,
+    "LARGE_BATCH_LIMIT": None,
+    "CHUNK_SIZE": 50,
+    "TEMPLATES": {},
+    "TRANSACTION_MODE": "per_item",
+    "TIMEOUT": None,
+    "LAYER_TIMEOUT": None,
+    "ITEM_TIMEOUT": None,
+    "TIMEOUT_HEADER": "HTTP_X_BATCH_TIMEOUT",
+    "TIMEOUT_HEADER_MAX": 300,
+    "RAW_RESPONSE_ASSEMBLY": False,
+    "RESOLVE_CACHE_SIZE": 256,
+    "SHARE_AUTHENTICATION": False,
+    "DEDUPE_REQUESTS": False,
+    "COALESCE_BULK_CREATE": False,
+    "ETAGS": False,
+    "HEADERS": "all",
+    "COMPRESSION": False,
+    "COMPRESS_MIN_LENGTH": 200,
+    "RESPONSE_CACHE": "default",
+    "CACHE_KEY_HEADERS": ["HTTP_ACCEPT", "HTTP_ACCEPT_LANGUAGE"],
+    "IDEMPOTENCY_HEADER": "HTTP_IDEMPOTENCY_KEY",
+    "IDEMPOTENCY_BACKEND": "libdrf.batch.idempotency.CacheBackend",
+    "IDEMPOTENCY_CACHE": "default",
+    "IDEMPOTENCY_TTL": 24 * 60 * 60,
+    "IDEMPOTENCY_LOCK_TIMEOUT": 60,
+    "ASYNC_EXECUTOR": "libdrf.batch.executors.AsyncExecutor",
+    "ASYNC_CONCURRENCY": 20,
+    "ASYNC_THREAD_SENSITIVE": False,
 }
 
 
@@ -39,6 +69,7 @@ class BatchSettings(object):
         self.user_settings = user_settings or {}
         self.defaults = defaults or {}
         self.executor = self._executor()
+        self.async_executor = self._async_executor()
 
     def _executor(self):
         """
@@ -51,7 +82,14 @@ class BatchSettings(object):
         else:
             executor_path = self.CONCURRENT_EXECUTOR
             executor_class = import_class(executor_path)
-            return executor_class(self.NUM_WORKERS)
+            return executor_class(self.NUM_WORKERS, **self.EXECUTOR_OPTIONS)
+
+    def _async_executor(self):
+        """
+            Executor used by the async batch view. Bounds the number of sub-requests in flight.
+        """
+        executor_class = import_class(self.ASYNC_EXECUTOR)
+        return executor_class(self.ASYNC_CONCURRENCY)
 
     def __getattr__(self, attr):
         """
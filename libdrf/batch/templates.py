@@ -0,0 +1,163 @@
+import re
+import threading
+from urllib.parse import quote
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .dependencies import REFERENCE_RE, iter_strings
+from .exceptions import BadBatchRequest
+from .executors import SequentialExecutor
+from .serializers import BatchRequestItemSerializer, BatchRequestSerializer
+from .settings import batch_settings
+
+# Parameter of a batch template, e.g. `{user_id}`.
+PARAM_RE = re.compile(r"\{([A-Za-z_]\w*)\}")
+
+
+def get_params(value):
+    """
+        Returns the names of the parameters used in a value.
+    """
+    return {match.group(1) for string in iter_strings(value) for match in PARAM_RE.finditer(string)}
+
+
+def quote_param(value, name):
+    """
+        Returns a parameter value quoted for use in a path, so it can't change the
+        route or the query string of the request.
+    """
+    if not isinstance(value, (str, int, float, bool)):
+        raise BadBatchRequest(
+            "Parameter {} is used in a path, it must be a string or a number.".format(name)
+        )
+    return quote(str(value), safe="")
+
+
+def fill(value, params, convert=None):
+    """
+        Replace the parameters in a value. A string that consists of a single parameter
+        is replaced by the parameter value itself, keeping its type, unless a convert
+        function is given. It is then applied to every parameter value.
+    """
+    def param(match, whole=False):
+        name = match.group(1)
+        if convert is not None:
+            return convert(params[name], name)
+        return params[name] if whole else str(params[name])
+
+    if isinstance(value, str):
+        match = PARAM_RE.fullmatch(value)
+        if match:
+            return param(match, whole=True)
+        return PARAM_RE.sub(param, value)
+    if isinstance(value, dict):
+        return {key: fill(item, params, convert) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [fill(item, params, convert) for item in value]
+    return value
+
+
+class BatchTemplate(object):
+
+    """
+        A named batch declared in the TEMPLATES setting, e.g.
+
+            "TEMPLATES": {
+                "profile": {
+                    "requests": [
+                        {"method": "get", "path": "/users/{user_id}"},
+                        {"method": "get", "path": "/users/{user_id}/orders"},
+                    ],
+                    "transaction": "per_item",
+                    "execute_parallel": False,
+                },
+            }
+
+        The definition is validated once, and every call gets its own copy of the
+        requests with the parameters filled in.
+        `execute_parallel: False` runs the batch sequentially, whatever the executor.
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        serializer = BatchRequestSerializer(data=definition)
+        if not serializer.is_valid():
+            raise ImproperlyConfigured(
+                "Invalid batch template {!r}: {}".format(name, serializer.errors)
+            )
+        self.specs = serializer.validated_data["requests"]
+        self.transaction_mode = serializer.validated_data.get("transaction")
+        self.executor = SequentialExecutor() if definition.get("execute_parallel") is False else None
+
+        # {index: parameters used}, for the requests that have any
+        self.params = {}
+        for index, spec in enumerate(self.specs):
+            params = get_params([spec["path"], spec.get("headers"), spec.get("body")])
+            if params:
+                self.params[index] = params
+        self.param_names = set().union(*self.params.values())
+
+    def render(self, params):
+        """
+            Returns the request specs with the given parameters filled in, quoted in
+            paths. Raises BadBatchRequest for missing parameters, parameter values
+            containing references, which could change the dependencies of the batch,
+            values in paths that aren't strings or numbers, and requests that are no
+            longer valid once filled in.
+        """
+        missing = self.param_names - set(params)
+        if missing:
+            raise BadBatchRequest(
+                "Missing parameters for batch template {}: {}.".format(
+                    self.name, ", ".join(sorted(missing))
+                )
+            )
+        if any(REFERENCE_RE.search(string) for string in iter_strings(params)):
+            raise BadBatchRequest("Parameters of batch templates can't contain references.")
+
+        # fill() copies the containers, so no call shares them with another.
+        specs = []
+        for spec in self.specs:
+            filled = {key: fill(value, params) for key, value in spec.items() if key != "path"}
+            filled["path"] = fill(spec["path"], params, quote_param)
+            specs.append(filled)
+        for index in self.params:
+            serializer = BatchRequestItemSerializer(data=specs[index])
+            if not serializer.is_valid():
+                raise BadBatchRequest(
+                    "Invalid request {} of batch template {}: {}".format(
+                        index, self.name, serializer.errors
+                    )
+                )
+            specs[index] = serializer.validated_data
+        return specs
+
+
+class TemplateRegistry(object):
+
+    """
+        Compiles the templates in the TEMPLATES setting on first use, and again when
+        their definition is replaced.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._templates = {}
+
+    def get(self, name):
+        """
+            Returns the BatchTemplate with this name, raises BadBatchRequest if unknown.
+        """
+        definition = batch_settings.TEMPLATES.get(name)
+        if definition is None:
+            raise BadBatchRequest("Unknown batch template {!r}.".format(name))
+
+        with self.lock:
+            cached_definition, template = self._templates.get(name, (None, None))
+            if cached_definition is not definition:
+                template = BatchTemplate(name, definition)
+                self._templates[name] = (definition, template)
+        return template
+
+
+templates = TemplateRegistry()
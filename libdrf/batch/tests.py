@@ -0,0 +1,1150 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import Resolver404, clear_url_caches, path, resolve
+from rest_framework import generics, parsers, permissions, serializers, status, views
+from rest_framework.response import Response
+from rest_framework.test import APITestCase
+
+from .. import db_routers
+from ..login.authentication import JWTAuthentication
+from ..login.cache import token_cache
+from ..login.factories import UserFactory
+from ..login.models import User
+from ..login.utils import jwt_encode_handler, jwt_payload_handler
+from . import executors, idempotency, transactions
+from .bulk import BulkCreateMixin
+from .exceptions import BatchTimeout
+from .metrics import metrics
+from .parsers import BatchJSONParser
+from .renderers import msgpack
+from .resolvers import CacheInfo, ResolverCache
+from .serializers import BatchRequestSerializer
+from .settings import DEFAULTS, BatchSettings, batch_settings
+from .throttles import BatchRateThrottle
+from .utils import BatchRequestBuilder
+from .views import (AsyncBatchRequestView, BatchRequestView, get_view_response,
+                    resolve_request)
+
+
+class EchoView(views.APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        if "sleep" in request.query_params:
+            time.sleep(float(request.query_params["sleep"]))
+        return Response({"path": request.path, "query": request.query_params.dict(), **kwargs})
+
+    def post(self, request, *args, **kwargs):
+        return Response(request.data, status=status.HTTP_201_CREATED)
+
+
+class ParsedEchoView(EchoView):
+    parser_classes = [BatchJSONParser]
+
+
+class ClaimView(ParsedEchoView):
+
+    def post(self, request, *args, **kwargs):
+        data = dict(request.data)
+        request.data["owner"] = None
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class WhoAmIView(views.APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response({"email": request.user.email})
+
+
+class CreateUserView(views.APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        user = UserFactory(email=request.data["email"])
+        return Response({"id": user.id}, status=status.HTTP_201_CREATED)
+
+
+class CachedView(views.APIView):
+    permission_classes = [permissions.AllowAny]
+    batch_cache_timeout = 60
+    calls = 0
+
+    def get(self, request, *args, **kwargs):
+        CachedView.calls += 1
+        return Response({"calls": CachedView.calls})
+
+
+class VersionedView(views.APIView):
+    permission_classes = [permissions.AllowAny]
+    version = 3
+    calls = 0
+
+    @staticmethod
+    def batch_version(request, *args, **kwargs):
+        return VersionedView.version
+
+    def get(self, request, *args, **kwargs):
+        VersionedView.calls += 1
+        return Response({"version": VersionedView.version})
+
+
+class CounterView(views.APIView):
+    permission_classes = [permissions.AllowAny]
+    count = 0
+
+    def get(self, request, *args, **kwargs):
+        return Response({"n": CounterView.count})
+
+    def post(self, request, *args, **kwargs):
+        CounterView.count += 1
+        return Response({"n": CounterView.count}, status=status.HTTP_201_CREATED)
+
+
+class NoDatabaseView(views.APIView):
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    batch_uses_database = False
+
+    def get(self, request, *args, **kwargs):
+        return Response({"database": False})
+
+
+class UserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ["id", "email"]
+
+
+class BulkUserView(BulkCreateMixin, generics.CreateAPIView):
+    permission_classes = [permissions.AllowAny]
+    queryset = User.objects.all()
+    serializer_class = UserSerializer
+
+
+class JWTBatchRequestView(BatchRequestView):
+    authentication_classes = [JWTAuthentication]
+
+
+class TestBatchRateThrottle(BatchRateThrottle):
+    rate = "10/min"
+
+
+class ThrottledBatchRequestView(BatchRequestView):
+    throttle_classes = [TestBatchRateThrottle]
+
+
+async def async_echo(request, pk):
+    return JsonResponse({"pk": pk, "async": True})
+
+
+async def async_state(request):
+    return JsonResponse({"routed": db_routers._state.get() is not None})
+
+
+urlpatterns = [
+    path("batch", BatchRequestView.as_view()),
+    path("jwt-batch", JWTBatchRequestView.as_view()),
+    path("throttled-batch", ThrottledBatchRequestView.as_view()),
+    path("whoami", WhoAmIView.as_view()),
+    path("users", CreateUserView.as_view()),
+    path("bulk-users", BulkUserView.as_view()),
+    path("cached", CachedView.as_view()),
+    path("versioned", VersionedView.as_view()),
+    path("counter", CounterView.as_view()),
+    path("no-db", NoDatabaseView.as_view()),
+    path("async-batch", AsyncBatchRequestView.as_view()),
+    path("echo", EchoView.as_view()),
+    path("echo/<int:pk>", EchoView.as_view()),
+    path("parsed-echo", ParsedEchoView.as_view()),
+    path("claim", ClaimView.as_view()),
+    path("async-echo/<int:pk>", async_echo),
+    path("async-state", async_state),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class BatchRequestTestCase(APITestCase):
+
+    def test_batch_requests(self):
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/1?foo=bar"},
+                {"method": "POST", "path": "/echo", "body": {"name": "banana"}},
+                {"method": "get", "path": "/missing"},
+            ]
+        }
+        resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        responses = resp.json()["responses"]
+        self.assertEqual(
+            [r["status_code"] for r in responses],
+            [status.HTTP_200_OK, status.HTTP_201_CREATED, status.HTTP_404_NOT_FOUND],
+        )
+        self.assertEqual(responses[0]["body"], {"path": "/echo/1", "query": {"foo": "bar"}, "pk": 1})
+        self.assertEqual(responses[1]["body"], {"name": "banana"})
+
+    def test_batch_request_references(self):
+        payload = {
+            "requests": [
+                {"method": "post", "path": "/echo", "body": {"id": 5, "tags": ["a"]}},
+                {"method": "get", "path": "/echo/{result=0:$.body.id}"},
+                {"method": "post", "path": "/echo", "body": {"parent": "{result=1:$.body.pk}", "tags": "{result=0:$.body.tags}"}},
+                {"method": "get", "path": "/missing"},
+                {"method": "get", "path": "/echo/1", "depends_on": [3]},
+                {"method": "get", "path": "/echo/{result=0:$.body.missing}"},
+            ]
+        }
+        resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        responses = resp.json()["responses"]
+        self.assertEqual(responses[1]["body"]["pk"], 5)
+        self.assertEqual(responses[2]["body"], {"parent": 5, "tags": ["a"]})
+        self.assertEqual(responses[4]["status_code"], status.HTTP_424_FAILED_DEPENDENCY)
+        self.assertEqual(responses[5]["status_code"], status.HTTP_424_FAILED_DEPENDENCY)
+
+    def test_batch_request_reference_escaping(self):
+        payload = {
+            "requests": [
+                {"method": "post", "path": "/echo", "body": {"name": "1/../2?is_staff=1", "none": None, "obj": {"a": 1}}},
+                {"method": "get", "path": "/echo/1?q={result=0:$.body.name}"},
+                {"method": "get", "path": "/echo/{result=0:$.body.name}"},
+                {"method": "get", "path": "/echo/{result=0:$.body.none}"},
+                {"method": "get", "path": "/echo/1", "headers": {"X-A": "{result=0:$.body.obj}"}},
+            ]
+        }
+        resp = self.client.post("/batch", payload, format="json")
+        responses = resp.json()["responses"]
+        # Referenced values can't add query parameters or change the route
+        self.assertEqual(responses[1]["body"]["query"], {"q": "1/../2?is_staff=1"})
+        self.assertEqual(responses[2]["status_code"], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(responses[3]["status_code"], status.HTTP_424_FAILED_DEPENDENCY)
+        self.assertEqual(responses[4]["status_code"], status.HTTP_424_FAILED_DEPENDENCY)
+
+    @mock.patch.object(batch_settings, "ADD_DURATION_HEADER", False)
+    def test_raw_response_assembly(self):
+        payload = {
+            "requests": [
+                {"method": "post", "path": "/echo", "body": {"id": 5, "name": "åäö"}},
+                {"method": "get", "path": "/echo/{result=0:$.body.id}"},
+                {"method": "get", "path": "/missing"},
+                {"method": "delete", "path": "/echo/1"},
+            ]
+        }
+        expected = self.client.post("/batch", payload, format="json")
+        with mock.patch.object(batch_settings, "RAW_RESPONSE_ASSEMBLY", True):
+            with mock.patch("libdrf.batch.views.json", wraps=json) as views_json:
+                resp = self.client.post("/batch", payload, format="json")
+                streamed = self.client.post(
+                    "/batch", payload, format="json", HTTP_ACCEPT="application/x-ndjson"
+                )
+                lines = b"".join(streamed.streaming_content).splitlines()
+            views_json.loads.assert_not_called()
+        self.assertEqual(resp.content, expected.content)
+        self.assertEqual(resp.json()["responses"][1]["body"]["pk"], 5)
+        self.assertEqual(sorted(json.loads(line)["index"] for line in lines), [0, 1, 2, 3])
+
+    def test_pre_parsed_request_body(self):
+        body = {"name": "banana", "tags": [1, 2]}
+        payload = {
+            "requests": [
+                {"method": "post", "path": "/parsed-echo", "body": body},
+                {"method": "post", "path": "/echo", "body": body},
+                {"method": "post", "path": "/parsed-echo", "body": body, "headers": {"Content-Type": "text/plain"}},
+            ]
+        }
+        with mock.patch.object(parsers.JSONParser, "parse", wraps=parsers.JSONParser().parse) as parse:
+            resp = self.client.post("/batch", payload, format="json")
+        responses = resp.json()["responses"]
+        self.assertEqual(responses[0]["body"], body)
+        self.assertEqual(responses[1]["body"], body)
+        self.assertEqual(responses[2]["status_code"], status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        # Only the outer batch request and the plain JSONParser view decode a body
+        self.assertEqual(parse.call_count, 2)
+
+    def test_batch_request_forward_reference(self):
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/{result=1:$.body.pk}"},
+                {"method": "get", "path": "/echo/1"},
+            ]
+        }
+        resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shared_authentication(self):
+        user, other = UserFactory(), UserFactory()
+        auth = "JWT {}".format(jwt_encode_handler(jwt_payload_handler(user)))
+        other_auth = "JWT {}".format(jwt_encode_handler(jwt_payload_handler(other)))
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/whoami", "headers": {"Authorization": auth}},
+                {"method": "get", "path": "/whoami?again", "headers": {"Authorization": auth}},
+                {"method": "get", "path": "/whoami", "headers": {"Authorization": other_auth}},
+                {"method": "get", "path": "/whoami"},
+            ]
+        }
+        authenticate = mock.patch.object(
+            JWTAuthentication, "authenticate_credentials", autospec=True,
+            side_effect=JWTAuthentication.authenticate_credentials,
+        )
+        for share, expected_calls in [(False, 4), (True, 2)]:
+            with mock.patch.object(batch_settings, "SHARE_AUTHENTICATION", share), authenticate as calls, \
+                    mock.patch.object(token_cache, "maxsize", 0):
+                resp = self.client.post("/jwt-batch", payload, format="json", HTTP_AUTHORIZATION=auth)
+            responses = resp.json()["responses"]
+            self.assertEqual(calls.call_count, expected_calls)
+            self.assertEqual(
+                [r["body"].get("email") for r in responses],
+                [user.email, user.email, other.email, None],
+            )
+            self.assertEqual(responses[3]["status_code"], status.HTTP_401_UNAUTHORIZED)
+
+    def test_transaction_modes(self):
+        def payload(transaction, email):
+            return {
+                "transaction": transaction,
+                "requests": [
+                    {"method": "post", "path": "/users", "body": {"email": email}},
+                    {"method": "get", "path": "/echo/1"},
+                    {"method": "get", "path": "/missing"},
+                ],
+            }
+
+        with mock.patch.object(transactions.transaction, "atomic", wraps=transaction.atomic) as atomic:
+            resp = self.client.post("/batch", payload("unsafe_only", "a@example.com"), format="json")
+        self.assertEqual([r["status_code"] for r in resp.data["responses"]], [201, 200, 404])
+        # Reads run without a transaction
+        self.assertEqual(atomic.call_count, 1)
+
+        with mock.patch.object(transactions.transaction, "atomic", wraps=transaction.atomic) as atomic:
+            resp = self.client.post("/batch", payload("savepoint", "b@example.com"), format="json")
+        self.assertEqual([r["status_code"] for r in resp.data["responses"]], [201, 200, 404])
+        # The batch, and a savepoint for the read as well as the write
+        self.assertEqual(atomic.call_count, 3)
+        self.assertTrue(User.objects.filter(email="b@example.com").exists())
+
+        resp = self.client.post("/batch", payload("all_or_nothing", "c@example.com"), format="json")
+        self.assertEqual([r["status_code"] for r in resp.data["responses"]], [424, 424, 404])
+        self.assertEqual(
+            resp.data["responses"][0]["body"], {"detail": "Batch rolled back, request 2 failed."}
+        )
+        self.assertFalse(User.objects.filter(email="c@example.com").exists())
+
+    def test_idempotency_key(self):
+        cache.clear()
+        payload = {"requests": [{"method": "post", "path": "/users", "body": {"email": "a@example.com"}}]}
+        resp = self.client.post("/batch", payload, format="json", HTTP_IDEMPOTENCY_KEY="1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(resp.has_header(idempotency.REPLAYED_HEADER))
+
+        # Retries are replayed without executing anything
+        retry = self.client.post("/batch", payload, format="json", HTTP_IDEMPOTENCY_KEY="1")
+        self.assertEqual(retry[idempotency.REPLAYED_HEADER], "true")
+        self.assertEqual(retry.json(), resp.json())
+        self.assertEqual(User.objects.filter(email="a@example.com").count(), 1)
+
+        # Unless the key is reused for another batch
+        other = {"requests": [{"method": "post", "path": "/users", "body": {"email": "b@example.com"}}]}
+        resp = self.client.post("/batch", other, format="json", HTTP_IDEMPOTENCY_KEY="1")
+        self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # Unrelated cookies don't change the key
+        retry = self.client.post(
+            "/batch", payload, format="json", HTTP_IDEMPOTENCY_KEY="1", HTTP_COOKIE="theme=dark"
+        )
+        self.assertEqual(retry[idempotency.REPLAYED_HEADER], "true")
+        # Other clients have their own keys
+        resp = self.client.post("/batch", other, format="json", HTTP_IDEMPOTENCY_KEY="1", HTTP_COOKIE="sessionid=other")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.filter(email="b@example.com").exists())
+
+        # Invalid batches aren't stored
+        resp = self.client.post("/batch", {"requests": [{}]}, format="json", HTTP_IDEMPOTENCY_KEY="2")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        payload = {"requests": [{"method": "get", "path": "/echo/1"}]}
+        resp = self.client.post("/batch", payload, format="json", HTTP_IDEMPOTENCY_KEY="2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(resp.has_header(idempotency.REPLAYED_HEADER))
+
+    def test_idempotency_key_in_flight(self):
+        cache.clear()
+        payload = {"requests": [{"method": "get", "path": "/echo/1"}]}
+        # Another process holds the lock of the key
+        key = "libdrf.batch.idempotency:in-flight"
+        fingerprint = idempotency.get_fingerprint(payload)
+        cache.add(key, {"fingerprint": fingerprint})
+
+        def finish():
+            time.sleep(0.1)
+            cache.set(key, {"fingerprint": fingerprint, "response": ({"responses": []}, 200)})
+
+        with mock.patch("libdrf.batch.views.get_idempotency_key", return_value=key), \
+                mock.patch.object(EchoView, "get", autospec=True, side_effect=EchoView.get) as get:
+            thread = threading.Thread(target=finish)
+            thread.start()
+            resp = self.client.post("/batch", payload, format="json")
+            thread.join()
+            self.assertEqual(resp.json(), {"responses": []})
+            self.assertEqual(resp[idempotency.REPLAYED_HEADER], "true")
+
+            cache.set(key, {"fingerprint": fingerprint})
+            with mock.patch.object(batch_settings, "IDEMPOTENCY_LOCK_TIMEOUT", 0.1):
+                resp = self.client.post("/batch", payload, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        get.assert_not_called()
+
+    def test_idempotency_lock_refresh(self):
+        cache.clear()
+        payload = {"requests": [{"method": "get", "path": "/echo/1?sleep=0.4"}]}
+        key = "libdrf.batch.idempotency:slow"
+
+        with mock.patch("libdrf.batch.views.get_idempotency_key", return_value=key), \
+                mock.patch.object(batch_settings, "IDEMPOTENCY_LOCK_TIMEOUT", 0.15):
+            thread = threading.Thread(target=self.client.post, args=("/batch", payload), kwargs={"format": "json"})
+            thread.start()
+            # The lock outlives its timeout while the batch executes
+            time.sleep(0.3)
+            self.assertEqual(cache.get(key), {"fingerprint": idempotency.get_fingerprint(payload)})
+            thread.join()
+        self.assertIn("response", cache.get(key))
+
+    @mock.patch.object(batch_settings, "DEDUPE_REQUESTS", True)
+    def test_dedupe_after_write(self):
+        CounterView.count = 0
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/counter"},
+                {"method": "post", "path": "/counter"},
+                {"method": "get", "path": "/counter", "depends_on": [1]},
+                {"method": "get", "path": "/counter", "depends_on": [2]},
+            ]
+        }
+        resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual([r["body"]["n"] for r in resp.data["responses"]], [0, 1, 1, 1])
+        with mock.patch.object(batch_settings, "CHUNK_SIZE", 2):
+            resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual([r["body"]["n"] for r in resp.data["responses"]], [1, 2, 2, 2])
+
+    def test_batch_rate_throttle(self):
+        cache.clear()
+        metrics.reset()
+        payload = {"requests": [{"method": "get", "path": "/echo/{}".format(pk)} for pk in range(4)]}
+        with mock.patch.object(BatchRequestView, "get_batch_specs", autospec=True,
+                               side_effect=BatchRequestView.get_batch_specs) as get_batch_specs:
+            resp = self.client.post("/throttled-batch", payload, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.post("/throttled-batch", payload, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            # 8 of 10 sub-requests are used up
+            resp = self.client.post("/throttled-batch", payload, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(get_batch_specs.call_count, 2)
+        self.assertGreater(int(resp["Retry-After"]), 50)
+
+        # Slow views cost more
+        cache.clear()
+        metrics.reset()
+        metrics.observe("view.{}".format(resolve("/echo/1").view_name), 0.2)
+        resp = self.client.post("/throttled-batch", {"requests": payload["requests"][:3]}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIsNone(resp.get("Retry-After"))
+        resp = self.client.post("/throttled-batch", {"requests": payload["requests"][:2]}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    @mock.patch.object(batch_settings, "DEDUPE_REQUESTS", True)
+    def test_dedupe_and_cache_requests(self):
+        cache.clear()
+        CachedView.calls = 0
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/1"},
+                {"method": "get", "path": "/echo/1"},
+                {"method": "get", "path": "/echo/1", "headers": {"Accept-Language": "sv"}},
+                {"method": "get", "path": "/cached"},
+                {"method": "get", "path": "/cached", "depends_on": [0]},
+            ]
+        }
+        with mock.patch.object(EchoView, "get", autospec=True, side_effect=EchoView.get) as get:
+            resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(get.call_count, 2)
+        responses = resp.data["responses"]
+        self.assertEqual(responses[0], responses[1])
+        self.assertEqual([r["body"] for r in responses[3:]], [{"calls": 1}, {"calls": 1}])
+
+        # Served from the response cache by the next batch
+        resp = self.client.post("/batch", {"requests": payload["requests"][3:4]}, format="json")
+        self.assertEqual(resp.data["responses"][0]["body"], {"calls": 1})
+        self.assertEqual(CachedView.calls, 1)
+
+        # Per user
+        resp = self.client.post(
+            "/batch", {"requests": payload["requests"][3:4]}, format="json",
+            HTTP_COOKIE="sessionid=other"
+        )
+        self.assertEqual(resp.data["responses"][0]["body"], {"calls": 2})
+
+    def test_streaming_batch_requests(self):
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/1?sleep=0.2"},
+                {"method": "get", "path": "/echo/2"},
+                {"method": "get", "path": "/missing"},
+            ]
+        }
+        executor = executors.ThreadBasedExecutor(3)
+        with mock.patch.object(batch_settings, "executor", executor):
+            resp = self.client.post(
+                "/batch", payload, format="json", HTTP_ACCEPT="application/x-ndjson"
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertTrue(resp.streaming)
+            lines = [json.loads(line) for line in b"".join(resp.streaming_content).splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1, 2])
+        # The slow sub-request is written last
+        self.assertEqual(lines[-1]["index"], 0)
+        self.assertEqual(lines[-1]["body"]["pk"], 1)
+
+    def test_batch_template(self):
+        template = {
+            "requests": [
+                {"method": "get", "path": "/echo/{pk}?q={query}"},
+                {"method": "post", "path": "/parsed-echo", "body": {"pk": "{pk}", "parent": "{result=0:$.body.pk}"}},
+                {"method": "get", "path": "/echo/1"},
+            ],
+            "execute_parallel": False,
+        }
+        with mock.patch.object(batch_settings, "TEMPLATES", {"profile": template}), \
+                mock.patch("libdrf.batch.templates.BatchRequestSerializer",
+                           wraps=BatchRequestSerializer) as serializer:
+            for pk in [3, 4]:
+                resp = self.client.post(
+                    "/batch", {"template": "profile", "params": {"pk": pk, "query": "a b"}},
+                    format="json"
+                )
+                responses = resp.json()["responses"]
+                self.assertEqual(responses[0]["body"], {"path": "/echo/{}".format(pk), "query": {"q": "a b"}, "pk": pk})
+                self.assertEqual(responses[1]["body"], {"pk": pk, "parent": pk})
+                self.assertEqual(responses[2]["body"]["pk"], 1)
+            # The template is only validated once
+            self.assertEqual(serializer.call_count, 1)
+
+            resp = self.client.post("/batch", {"template": "profile", "params": {"pk": 1}}, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("query", resp.data["detail"])
+            resp = self.client.post(
+                "/batch", {"template": "profile", "params": {"pk": "{result=2:$.body}", "query": ""}},
+                format="json"
+            )
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            resp = self.client.post("/batch", {"template": "missing"}, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_template_copies(self):
+        template = {"requests": [{"method": "post", "path": "/claim", "body": {"name": "x"}}]}
+        with mock.patch.object(batch_settings, "TEMPLATES", {"claim": template}):
+            for _ in range(2):
+                resp = self.client.post("/batch", {"template": "claim"}, format="json")
+                self.assertEqual(resp.data["responses"][0]["body"], {"name": "x"})
+
+    def test_batch_template_validation(self):
+        template = {"requests": [{"method": "get", "path": "{path}", "headers": {"X-Pk": "{pk}"}}]}
+        with mock.patch.object(batch_settings, "TEMPLATES", {"echo": template}):
+            # Parameters are coerced like the fields of a batch request
+            resp = self.client.post(
+                "/batch", {"template": "echo", "params": {"path": 5, "pk": 5}}, format="json"
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.data["responses"][0]["status_code"], 404)
+
+            resp = self.client.post(
+                "/batch", {"template": "echo", "params": {"path": {"a": 1}, "pk": 5}}, format="json"
+            )
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("path", resp.data["detail"])
+
+            resp = self.client.post(
+                "/batch", {"template": "echo", "params": {"path": "/echo/1", "pk": [5]}}, format="json"
+            )
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Parameters can't change the route or the query string
+        template = {"requests": [{"method": "get", "path": "/echo/{pk}"}, {"method": "get", "path": "/echo/1?q={q}"}]}
+        with mock.patch.object(batch_settings, "TEMPLATES", {"echo": template}):
+            resp = self.client.post(
+                "/batch", {"template": "echo", "params": {"pk": "1?x=y", "q": "a&is_staff=1"}}, format="json"
+            )
+            responses = resp.data["responses"]
+            self.assertEqual(responses[0]["status_code"], 404)
+            self.assertEqual(responses[1]["body"]["query"], {"q": "a&is_staff=1"})
+            resp = self.client.post(
+                "/batch", {"template": "echo", "params": {"pk": "1/../../admin", "q": ""}}, format="json"
+            )
+            self.assertEqual(resp.data["responses"][0]["status_code"], 404)
+
+    def test_large_batch(self):
+        requests = [{"method": "get", "path": "/echo/{}".format(i)} for i in range(30)]
+        requests[25] = {"method": "get", "path": "/echo/{result=2:$.body.pk}?again"}
+        payload = {"requests": requests}
+        with mock.patch.object(batch_settings, "LARGE_BATCH_LIMIT", 100), \
+                mock.patch.object(batch_settings, "CHUNK_SIZE", 5):
+            # The limit is checked before validating the requests
+            with mock.patch("libdrf.batch.views.BatchRequestSerializer") as serializer:
+                resp = self.client.post("/batch", payload, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("maximum of 20 requests", resp.data["detail"])
+            serializer.assert_not_called()
+
+            with mock.patch.object(BatchRequestView, "prune_responses",
+                                   autospec=True, side_effect=BatchRequestView.prune_responses) as prune:
+                resp = self.client.post(
+                    "/batch", payload, format="json", HTTP_ACCEPT="application/x-ndjson"
+                )
+                lines = [json.loads(line) for line in b"".join(resp.streaming_content).splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines), list(range(30)))
+        by_index = {line["index"]: line for line in lines}
+        self.assertEqual(by_index[25]["body"]["pk"], 2)
+        self.assertEqual(prune.call_count, 6)
+
+        with mock.patch.object(batch_settings, "LARGE_BATCH_LIMIT", 25):
+            resp = self.client.post(
+                "/batch", payload, format="json", HTTP_ACCEPT="application/x-ndjson"
+            )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_process_based_executor(self):
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/1?foo=bar"},
+                {"method": "post", "path": "/parsed-echo", "body": {"name": "banana"}},
+            ]
+        }
+        executor = executors.ProcessBasedExecutor(2)
+        try:
+            for raw in [False, True]:
+                with mock.patch.object(batch_settings, "executor", executor), \
+                        mock.patch.object(batch_settings, "RAW_RESPONSE_ASSEMBLY", raw):
+                    resp = self.client.post("/batch", payload, format="json")
+                responses = resp.json()["responses"]
+                self.assertEqual([r["status_code"] for r in responses], [200, 201])
+                self.assertEqual(responses[0]["body"], {"path": "/echo/1", "query": {"foo": "bar"}, "pk": 1})
+                self.assertEqual(responses[1]["body"], {"name": "banana"})
+        finally:
+            executor.executor_pool.shutdown()
+
+    def test_timing_headers(self):
+        user = UserFactory()
+        auth = "JWT {}".format(jwt_encode_handler(jwt_payload_handler(user)))
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/whoami", "headers": {"Authorization": auth}},
+                {"method": "post", "path": "/users", "body": {"email": "timing@example.com"}},
+            ]
+        }
+        # Server-Timing and the query counting are opt-in
+        resp = self.client.post("/batch", {"requests": payload["requests"][:1]}, format="json")
+        self.assertIn(batch_settings.DURATION_HEADER_NAME, resp.data["responses"][0]["headers"])
+        self.assertNotIn("Server-Timing", resp.data["responses"][0]["headers"])
+
+        metrics.reset()
+        with mock.patch.object(batch_settings, "SERVER_TIMING", True):
+            resp = self.client.post("/batch", payload, format="json")
+        whoami, users = resp.data["responses"]
+        self.assertEqual(whoami["status_code"], status.HTTP_200_OK)
+        self.assertGreater(float(whoami["headers"][batch_settings.DURATION_HEADER_NAME]), 0)
+        steps = [part.split(";")[0] for part in whoami["headers"]["Server-Timing"].split(", ")]
+        self.assertEqual(steps[:3], ["queue", "build", "resolve"])
+        self.assertIn("auth", steps)
+        self.assertIn("render", steps)
+        self.assertIn("sql", users["headers"]["Server-Timing"])
+        self.assertIn('queries;desc="', users["headers"]["Server-Timing"])
+
+        snapshot = metrics.snapshot()
+        self.assertGreaterEqual(snapshot["timers"]["timing.total"]["count"], 2)
+        self.assertGreater(snapshot["counters"]["sql.queries"], 0)
+
+    def test_etags_opt_in(self):
+        payload = {"requests": [{"method": "get", "path": "/echo/1", "headers": {"If-None-Match": "*"}}]}
+        resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual(resp.data["responses"][0]["status_code"], 200)
+        self.assertNotIn("ETag", resp.data["responses"][0]["headers"])
+
+    @mock.patch.object(batch_settings, "ETAGS", True)
+    def test_conditional_requests(self):
+        resp = self.client.post("/batch", {"requests": [{"method": "get", "path": "/echo/1"}]}, format="json")
+        etag = resp.data["responses"][0]["headers"]["ETag"]
+
+        VersionedView.calls = 0
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/1", "headers": {"If-None-Match": etag}},
+                {"method": "get", "path": "/echo/2", "headers": {"If-None-Match": etag}},
+                {"method": "get", "path": "/versioned", "headers": {"If-None-Match": '"3"'}},
+                {"method": "get", "path": "/versioned", "headers": {"If-None-Match": '"2"'}},
+            ]
+        }
+        resp = self.client.post("/batch", payload, format="json")
+        responses = resp.data["responses"]
+        self.assertEqual([r["status_code"] for r in responses], [304, 200, 304, 200])
+        self.assertIsNone(responses[0]["body"])
+        self.assertEqual(responses[0]["headers"]["ETag"], etag)
+        self.assertNotEqual(responses[1]["headers"]["ETag"], etag)
+        # The view is skipped when the client has the current version
+        self.assertEqual(VersionedView.calls, 1)
+        self.assertEqual(responses[3]["headers"]["ETag"], '"3"')
+        self.assertEqual(responses[3]["body"], {"version": 3})
+
+        # A failing version function doesn't fail the batch, the view is called instead
+        with mock.patch.object(VersionedView, "batch_version", side_effect=ValueError):
+            resp = self.client.post("/batch", {"requests": payload["requests"][2:3]}, format="json")
+        self.assertEqual(resp.data["responses"][0]["status_code"], 200)
+        self.assertEqual(VersionedView.calls, 2)
+
+    @mock.patch.object(batch_settings, "ETAGS", True)
+    def test_response_headers_modes(self):
+        payload = {"requests": [{"method": "get", "path": "/echo/1"}, {"method": "get", "path": "/echo/2"}]}
+        with mock.patch.object(batch_settings, "HEADERS", "none"):
+            resp = self.client.post("/batch", payload, format="json")
+        self.assertTrue(all("headers" not in r for r in resp.json()["responses"]))
+
+        with mock.patch.object(batch_settings, "HEADERS", "dedupe"):
+            resp = self.client.post("/batch", payload, format="json")
+        data = resp.json()
+        self.assertEqual(data["headers"]["Content-Type"], "application/json")
+        for response in data["responses"]:
+            self.assertNotIn("Content-Type", response["headers"])
+            # ETags differ
+            self.assertIn("ETag", response["headers"])
+
+    @mock.patch.object(batch_settings, "COMPRESSION", True)
+    def test_compressed_responses(self):
+        payload = {"requests": [{"method": "get", "path": "/echo/{}".format(pk)} for pk in range(5)]}
+        resp = self.client.post("/batch", payload, format="json", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp["Vary"])
+        data = json.loads(gzip.decompress(resp.content))
+        self.assertEqual([r["body"]["pk"] for r in data["responses"]], list(range(5)))
+
+        resp = self.client.post("/batch", payload, format="json")
+        self.assertFalse(resp.has_header("Content-Encoding"))
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_batch_requests(self):
+        payload = msgpack.packb({"requests": [{"method": "post", "path": "/echo", "body": {"a": [1, 2]}}]})
+        resp = self.client.post(
+            "/batch", payload, content_type="application/msgpack", HTTP_ACCEPT="application/msgpack"
+        )
+        self.assertEqual(resp["Content-Type"], "application/msgpack")
+        data = msgpack.unpackb(resp.content)
+        self.assertEqual(data["responses"][0]["body"], {"a": [1, 2]})
+
+    @mock.patch.object(batch_settings, "COALESCE_BULK_CREATE", True)
+    def test_coalesce_bulk_create(self):
+        def create(email):
+            return {"method": "post", "path": "/bulk-users", "body": {"email": email}}
+
+        payload = {
+            "requests": [
+                create("one@example.com"),
+                create("invalid"),
+                create("two@example.com"),
+                {"method": "get", "path": "/echo/1"},
+                create("three@example.com"),
+            ]
+        }
+        metrics.reset()
+        with mock.patch.object(
+            User.objects, "bulk_create", wraps=User.objects.bulk_create
+        ) as bulk_create:
+            resp = self.client.post("/batch", payload, format="json")
+        responses = resp.data["responses"]
+        self.assertEqual([r["status_code"] for r in responses], [201, 400, 201, 200, 201])
+        self.assertEqual(bulk_create.call_count, 1)
+        self.assertEqual(metrics.snapshot()["counters"]["bulk_create.coalesced"], 3)
+        self.assertEqual(responses[0]["body"]["id"], User.objects.get(email="one@example.com").id)
+        self.assertEqual(responses[0]["reason_phrase"], "Created")
+        self.assertIn("email", responses[1]["body"])
+        self.assertEqual(responses[4]["body"]["email"], "three@example.com")
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_batch_timeouts(self):
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/echo/1?sleep=0.5"},
+                {"method": "get", "path": "/echo/2"},
+                {"method": "get", "path": "/echo/{result=0:$.body.pk}"},
+            ]
+        }
+        executor = executors.ThreadBasedExecutor(3)
+        with mock.patch.object(batch_settings, "executor", executor), \
+                mock.patch.object(batch_settings, "LAYER_TIMEOUT", 0.1):
+            resp = self.client.post("/batch", payload, format="json")
+        self.assertEqual(
+            [r["status_code"] for r in resp.data["responses"]], [504, 200, 424]
+        )
+        self.assertEqual(resp.data["responses"][0]["body"], {"detail": "Request timed out."})
+
+        # LAYER_TIMEOUT bounds the whole layer, including the time spent queued
+        layer = {"requests": [{"method": "get", "path": "/echo/1?sleep=0.3"}] * 3}
+        with mock.patch.object(batch_settings, "executor", executors.ThreadBasedExecutor(2)), \
+                mock.patch.object(batch_settings, "LAYER_TIMEOUT", 0.5):
+            resp = self.client.post("/batch", layer, format="json")
+        self.assertEqual([r["status_code"] for r in resp.data["responses"]], [200, 200, 504])
+
+        # ITEM_TIMEOUT runs from when each item starts, not from when it is queued
+        with mock.patch.object(batch_settings, "executor", executors.ThreadBasedExecutor(2)), \
+                mock.patch.object(batch_settings, "ITEM_TIMEOUT", 0.5):
+            resp = self.client.post("/batch", layer, format="json")
+            self.assertEqual([r["status_code"] for r in resp.data["responses"]], [200, 200, 200])
+            resp = self.client.post("/batch", {"requests": [
+                {"method": "get", "path": "/echo/1?sleep=1"},
+                {"method": "get", "path": "/echo/2"},
+            ]}, format="json")
+            self.assertEqual([r["status_code"] for r in resp.data["responses"]], [504, 200])
+
+        # Client timeouts are capped, and must be finite
+        with mock.patch.object(batch_settings, "executor", executors.ThreadBasedExecutor(2)), \
+                mock.patch.object(batch_settings, "TIMEOUT_HEADER_MAX", 0):
+            for header in ["inf", "1e308", "nan"]:
+                resp = self.client.post(
+                    "/batch", {"requests": [{"method": "get", "path": "/echo/2"}]},
+                    format="json", HTTP_X_BATCH_TIMEOUT=header
+                )
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.data["responses"][0]["status_code"], 200)
+            resp = self.client.post(
+                "/batch", {"requests": [{"method": "get", "path": "/echo/2"}]},
+                format="json", HTTP_X_BATCH_TIMEOUT="10"
+            )
+            self.assertEqual(resp.data["responses"][0]["status_code"], 504)
+
+        # The client can shorten the deadline of the batch
+        resp = self.client.post("/batch", payload, format="json", HTTP_X_BATCH_TIMEOUT="0")
+        self.assertEqual([r["status_code"] for r in resp.data["responses"]], [504, 504, 424])
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ResolverCacheTestCase(TestCase):
+
+    def test_resolver_cache(self):
+        cache = ResolverCache(2)
+        self.assertEqual(cache.resolve("/echo/1").kwargs, {"pk": 1})
+        self.assertEqual(cache.resolve("/echo/1").kwargs, {"pk": 1})
+        cache.resolve("/echo/2")
+        cache.resolve("/echo")
+        self.assertEqual(cache.cache_info(), CacheInfo(hits=1, misses=3, maxsize=2, currsize=2))
+        with self.assertRaises(Resolver404):
+            cache.resolve("/missing")
+
+        # Reloading the URLconfs invalidates the cache
+        clear_url_caches()
+        cache.resolve("/echo")
+        self.assertEqual(cache.cache_info(), CacheInfo(hits=1, misses=5, maxsize=2, currsize=1))
+
+
+class BatchRequestBuilderTestCase(TestCase):
+
+    def test_build_requests(self):
+        parent = RequestFactory().post("/batch", HTTP_USER_AGENT="tests", HTTP_X_OTHER="ignored")
+        builder = BatchRequestBuilder(parent)
+        get = builder.build("get", "/echo/1?foo=bar", {"Accept-Language": "sv", "User-Agent": "item"}, None)
+        post = builder.build("post", "/echo", {}, {"name": "banana"})
+
+        self.assertEqual(get.method, "GET")
+        self.assertEqual(get.path, "/echo/1")
+        self.assertEqual(get.GET["foo"], "bar")
+        self.assertEqual(get.META["HTTP_ACCEPT_LANGUAGE"], "sv")
+        self.assertEqual(get.META["HTTP_USER_AGENT"], "item")
+        self.assertNotIn("HTTP_X_OTHER", get.META)
+        self.assertEqual(get.body, b"")
+
+        self.assertEqual(post.META["HTTP_USER_AGENT"], "tests")
+        self.assertEqual(post.content_type, "application/json")
+        self.assertEqual(json.loads(post.body), {"name": "banana"})
+        self.assertEqual(post.batch_data, {"name": "banana"})
+
+        quoted = builder.build("get", "/echo/caf%C3%A9%2Fx?q=%C3%A9", {}, None)
+        self.assertEqual(quoted.path, "/echo/café/x")
+        self.assertEqual(quoted.GET["q"], "é")
+
+
+class ThreadBasedExecutorTestCase(TestCase):
+
+    def test_connection_lifecycle(self):
+        executor = executors.ThreadBasedExecutor(2)
+
+        with mock.patch.object(executors, "close_old_connections") as close_old_connections:
+            result = executor.execute(list(range(6)), lambda request: request * 2)
+        self.assertEqual(result, [0, 2, 4, 6, 8, 10])
+        # Before and after every task
+        self.assertEqual(close_old_connections.call_count, 12)
+
+        gauges = executor.connection_gauges()
+        self.assertTrue(0 < len(gauges) <= 2)
+        self.assertTrue(all(name.startswith("batch") for name in gauges))
+        self.assertTrue(set(
+            "db_connections.{}".format(name) for name in gauges
+        ) <= set(metrics.snapshot()["gauges"]))
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_max_db_workers(self):
+        executor = executors.ThreadBasedExecutor(8, max_db_workers=2)
+        self.assertEqual(executor.num_workers, 8)
+        running = []
+        peaks = []
+        lock = threading.Lock()
+
+        def task(request):
+            with lock:
+                running.append(request)
+                peaks.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(request)
+
+        # Tasks that may use the database share the two slots
+        with mock.patch.object(executors.connections, "close_all") as close_all:
+            executor.execute([SimpleNamespace(path_info="/echo") for _ in range(6)], task)
+        self.assertEqual(max(peaks), 2)
+        self.assertEqual(close_all.call_count, 6)
+
+        # Views that don't, don't wait for one
+        peaks.clear()
+        with mock.patch.object(executors.connections, "close_all") as close_all:
+            executor.execute([SimpleNamespace(path_info="/no-db") for _ in range(6)], task)
+        self.assertGreater(max(peaks), 2)
+        close_all.assert_not_called()
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_no_database_view(self):
+        request = RequestFactory().get("/no-db")
+        match = resolve_request(request)
+        with mock.patch("libdrf.batch.views.item_atomic") as atomic:
+            response = get_view_response(request, match)
+        self.assertEqual(response.status_code, 200)
+        atomic.assert_not_called()
+
+
+class AdaptiveExecutorTestCase(TestCase):
+
+    def test_adaptive_width(self):
+        executor = executors.AdaptiveExecutor(4)
+        requests = [SimpleNamespace(path_info="/fast") for _ in range(3)]
+
+        # Unknown views are expected to be slow enough to fan out
+        self.assertEqual(executor.get_width(["/fast"] * 3), 3)
+        threads = executor.execute(requests, lambda request: threading.current_thread().name)
+        self.assertTrue(all(name.startswith("batch") for name in threads))
+
+        # Now known to be fast, so run inline
+        self.assertEqual(executor.get_width(["/fast"] * 3), 0)
+        threads = executor.execute(requests, lambda request: threading.current_thread().name)
+        self.assertEqual(set(threads), {threading.current_thread().name})
+
+        executor.latencies = {"/slow": 0.1, "/fast": 0.001}
+        self.assertEqual(executor.get_width(["/slow"] + ["/fast"] * 3), 2)
+
+    def test_adaptive_settings(self):
+        settings = BatchSettings({
+            "EXECUTE_PARALLEL": True,
+            "CONCURRENT_EXECUTOR": "libdrf.batch.executors.AdaptiveExecutor",
+            "NUM_WORKERS": 2,
+        }, DEFAULTS)
+        self.assertIsInstance(settings.executor, executors.AdaptiveExecutor)
+        self.assertEqual(settings.executor.num_workers, 2)
+
+
+class FairExecutorTestCase(TestCase):
+
+    def test_round_robin_between_batches(self):
+        executor = executors.FairExecutor(1, max_per_batch=1)
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def generator(request):
+            order.append(request)
+            if request == "a0":
+                started.set()
+                release.wait(5)
+            return request
+
+        results = {}
+        first = threading.Thread(target=lambda: results.update(
+            a=executor.execute(["a0", "a1", "a2"], generator)
+        ))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.update(b=executor.execute(["b0"], generator)))
+        second.start()
+        while executor.queue_depth() < 3:
+            time.sleep(0.001)
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(results, {"a": ["a0", "a1", "a2"], "b": ["b0"]})
+        # The later batch doesn't wait for the whole first one
+        self.assertEqual(order, ["a0", "a1", "b0", "a2"])
+        self.assertEqual(executor.queue_depth(), 0)
+        self.assertGreaterEqual(metrics.snapshot()["timers"]["fair.wait"]["count"], 4)
+
+    def test_submit(self):
+        executor = executors.FairExecutor(2)
+        futures = [executor.submit(lambda request, n: request * n, request, 2) for request in [1, 2]]
+        self.assertEqual([future.result(5) for future in futures], [2, 4])
+        self.assertEqual(executor.queue_depth(), 0)
+
+        # New tasks don't push the queued batches back
+        executor = executors.FairExecutor(1, max_per_batch=1)
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def generator(request):
+            order.append(request)
+            if request == "a0":
+                started.set()
+                release.wait(5)
+            return request
+
+        batch = threading.Thread(target=executor.execute, args=(["a0", "a1"], generator))
+        batch.start()
+        started.wait(5)
+        futures = [executor.submit(generator, request) for request in ["x", "y"]]
+        release.set()
+        batch.join(5)
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ["a0", "a1", "x", "y"])
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncBatchRequestTestCase(TestCase):
+
+    async def test_async_batch_requests(self):
+        payload = {
+            "requests": [
+                {"method": "get", "path": "/async-echo/{}".format(pk)} for pk in range(5)
+            ] + [{"method": "get", "path": "/echo/7"}]
+        }
+        resp = await self.async_client.post(
+            "/async-batch", json.dumps(payload), content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        bodies = [r["body"] for r in resp.json()["responses"]]
+        # Plain Django responses are passed through as text
+        self.assertEqual([json.loads(b) for b in bodies[:5]], [{"pk": pk, "async": True} for pk in range(5)])
+        self.assertEqual(bodies[5]["pk"], 7)
+
+    async def test_async_streaming_batch_requests(self):
+        payload = {"requests": [{"method": "get", "path": "/async-echo/{}".format(pk)} for pk in range(3)]}
+        resp = await self.async_client.post(
+            "/async-batch", json.dumps(payload), content_type="application/json",
+            headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertTrue(resp.streaming)
+        lines = [json.loads(line) async for line in resp.streaming_content]
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1, 2])
+
+    @mock.patch.object(batch_settings, "COMPRESSION", True)
+    async def test_async_compressed_streaming(self):
+        payload = {"requests": [{"method": "get", "path": "/async-echo/{}".format(pk)} for pk in range(3)]}
+        resp = await self.async_client.post(
+            "/async-batch", json.dumps(payload), content_type="application/json",
+            headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        content = b"".join([chunk async for chunk in resp.streaming_content])
+        lines = [json.loads(line) for line in gzip.decompress(content).splitlines()]
+        self.assertEqual(sorted(line["index"] for line in lines), [0, 1, 2])
+
+    async def test_async_sync_views_concurrency(self):
+        payload = {"requests": [{"method": "get", "path": "/echo/{}?sleep=0.2".format(pk)} for pk in range(3)]}
+        start = time.monotonic()
+        resp = await self.async_client.post(
+            "/async-batch", json.dumps(payload), content_type="application/json"
+        )
+        self.assertEqual([r["status_code"] for r in resp.json()["responses"]], [200] * 3)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    async def test_async_view_context(self):
+        payload = {"requests": [
+            {"method": "get", "path": "/async-state"},
+            {"method": "post", "path": "/async-state"},
+        ]}
+        with mock.patch("libdrf.batch.views.item_atomic", wraps=transactions.item_atomic) as atomic, \
+                mock.patch.object(batch_settings, "TRANSACTION_MODE", transactions.UNSAFE_ONLY):
+            resp = await self.async_client.post(
+                "/async-batch", json.dumps(payload), content_type="application/json"
+            )
+        # Async views are routed, and get a transaction when the mode asks for one
+        self.assertEqual([json.loads(r["body"]) for r in resp.json()["responses"]], [{"routed": True}] * 2)
+        self.assertEqual(
+            sorted(call.args for call in atomic.call_args_list),
+            [("GET", transactions.UNSAFE_ONLY), ("POST", transactions.UNSAFE_ONLY)],
+        )
+
+    async def test_async_batch_invalid_payload(self):
+        resp = await self.async_client.post(
+            "/async-batch", json.dumps({"requests": [{"path": "/echo"}]}),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("requests", resp.json())
+
+    async def test_async_executor_concurrency(self):
+        in_flight = []
+        peak = []
+
+        async def generator(request):
+            in_flight.append(request)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(request)
+            return request * 2
+
+        executor = executors.AsyncExecutor(2)
+        result = await executor.execute(list(range(6)), generator)
+        self.assertEqual(result, [0, 2, 4, 6, 8, 10])
+        self.assertEqual(max(peak), 2)
+
+    async def test_async_executor_timeout(self):
+        async def generator(request):
+            await asyncio.sleep(request)
+            return request
+
+        executor = executors.AsyncExecutor(2)
+        results = []
+        with self.assertRaises(BatchTimeout) as cm:
+            async for index, result in executor.execute_as_completed([0, 5, 0], generator, timeout=0.1):
+                results.append(index)
+        self.assertEqual(sorted(results), [0, 2])
+        self.assertEqual(cm.exception.indices, [1])
+
+    async def test_async_executor_item_timeout(self):
+        async def generator(request):
+            await asyncio.sleep(request)
+            return request
+
+        # The items queued behind the slow ones get their full item_timeout once started
+        executor = executors.AsyncExecutor(1)
+        results = {}
+        async for index, result in executor.execute_as_completed(
+            [0.15, 5, 0.15], generator, item_timeout=0.2
+        ):
+            results[index] = result
+        self.assertEqual(results[0], 0.15)
+        self.assertIsInstance(results[1], BatchTimeout)
+        self.assertEqual(results[2], 0.15)
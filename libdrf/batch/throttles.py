@@ -0,0 +1,113 @@
+import math
+from urllib.parse import urlsplit
+
+from django.urls.exceptions import Resolver404
+from rest_framework.throttling import SimpleRateThrottle
+
+from .exceptions import BadBatchRequest
+from .metrics import metrics
+from .resolvers import resolver_cache
+from .templates import templates
+
+
+class BatchRateThrottle(SimpleRateThrottle):
+
+    """
+        Limits the rate of sub-requests instead of batches, per user or per IP address
+        for anonymous users, with the "batch" rate of DEFAULT_THROTTLE_RATES.
+
+        Every sub-request costs at least 1, views that are on average slower than
+        base_latency seconds cost proportionally more, up to max_weight. The cost is
+        computed from the payload before anything is validated or built, so batches
+        over the budget are rejected cheaply.
+    """
+    scope = "batch"
+    base_latency = 0.05
+    max_weight = 10
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+    def get_weight(self, path):
+        """
+            Returns the cost of a sub-request to this path, from the mean latency of its view.
+        """
+        try:
+            match = resolver_cache.resolve(urlsplit(path).path)
+        except Resolver404:
+            return 1
+        timer = metrics.get_timer("view.{}".format(match.view_name))
+        if timer is None or not timer.count:
+            return 1
+        mean = timer.total / timer.count
+        return min(max(mean / self.base_latency, 1), self.max_weight)
+
+    def get_specs(self, request):
+        """
+            Returns the unvalidated sub-request specs of the batch.
+        """
+        data = request.data
+        if not isinstance(data, dict):
+            return []
+        if "template" in data:
+            try:
+                return templates.get(data["template"]).specs
+            except (BadBatchRequest, TypeError):
+                return []
+        requests = data.get("requests")
+        return requests if isinstance(requests, list) else []
+
+    def get_cost(self, request):
+        weight = 0
+        for spec in self.get_specs(request):
+            path = spec.get("path") if isinstance(spec, dict) else None
+            weight += self.get_weight(path) if isinstance(path, str) else 1
+        return max(math.ceil(weight), 1)
+
+    def allow_request(self, request, view):
+        """
+            Same as SimpleRateThrottle, with a history of (timestamp, cost) pairs.
+        """
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.cost = self.get_cost(request)
+        self.history = self.cache.get(self.key, [])
+        self.now = self.timer()
+
+        # Drop any requests from the history which have now passed the throttle duration
+        while self.history and self.history[-1][0] <= self.now - self.duration:
+            self.history.pop()
+        if self.get_used() + self.cost > self.num_requests:
+            return self.throttle_failure()
+        return self.throttle_success()
+
+    def get_used(self):
+        return sum(cost for timestamp, cost in self.history)
+
+    def throttle_success(self):
+        self.history.insert(0, (self.now, self.cost))
+        self.cache.set(self.key, self.history, self.duration)
+        return True
+
+    def wait(self):
+        """
+            Returns the number of seconds until enough of the history has expired to
+            allow a batch of this cost, or None if it never will be.
+        """
+        if self.cost > self.num_requests:
+            return None
+        needed = self.get_used() + self.cost - self.num_requests
+        for timestamp, cost in reversed(self.history):
+            needed -= cost
+            if needed <= 0:
+                return max(self.duration - (self.now - timestamp), 0)
+        return None
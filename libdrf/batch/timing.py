@@ -0,0 +1,112 @@
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+from .metrics import metrics
+from .settings import batch_settings
+from .utils import TIMING_ATTR
+
+SERVER_TIMING_HEADER = "Server-Timing"
+
+
+class Timer(object):
+
+    """
+        Collects the timing breakdown of a sub-request, in seconds:
+
+        - queue: from building the request until a worker picks it up
+        - build: constructing the WSGI request
+        - resolve: resolving the view
+        - auth: from calling the view until the request is authenticated
+        - view: the rest of the view
+        - render: rendering and serializing the response
+        - sql: the time spent in database queries, counted in queries, with SERVER_TIMING
+
+        The total is also recorded per view, as the `view.<view name>` timer.
+    """
+
+    def __init__(self, wsgi_request):
+        self.wsgi_request = wsgi_request
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.queries = 0
+        built = getattr(wsgi_request, TIMING_ATTR, None)
+        if built is not None:
+            self.timings["queue"] = max(self.start - built["built_at"], 0)
+            self.timings["build"] = built["build"]
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
+
+    @contextmanager
+    def view(self, wsgi_request):
+        """
+            Times the view, split into the authentication and the rest of the view.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            authenticated_at = getattr(wsgi_request, "authenticated_at", None)
+            if authenticated_at is not None and start <= authenticated_at <= end:
+                self.timings["auth"] = authenticated_at - start
+                start = authenticated_at
+            self.timings["view"] = end - start
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.timings["sql"] = self.timings.get("sql", 0) + time.perf_counter() - start
+
+    @contextmanager
+    def count_queries(self):
+        """
+            Counts the queries run on this thread, on all databases, with SERVER_TIMING.
+        """
+        with ExitStack() as stack:
+            for conn in connections.all() if batch_settings.SERVER_TIMING else ():
+                stack.enter_context(conn.execute_wrapper(self.execute_wrapper))
+            yield
+
+    def get_headers(self, duration):
+        headers = {batch_settings.DURATION_HEADER_NAME: "{:.6f}".format(duration)}
+        if batch_settings.SERVER_TIMING:
+            parts = [
+                "{};dur={:.3f}".format(name, seconds * 1000)
+                for name, seconds in self.timings.items()
+            ]
+            if self.queries:
+                parts.append('queries;desc="{} queries"'.format(self.queries))
+            headers[SERVER_TIMING_HEADER] = ", ".join(parts)
+        return headers
+
+    def finish(self, response):
+        """
+            Records the timings in the metrics, and returns the response with the
+            duration header if ADD_DURATION_HEADER is enabled, and the Server-Timing
+            header if SERVER_TIMING is enabled as well.
+        """
+        duration = time.perf_counter() - self.start
+        for name, seconds in self.timings.items():
+            metrics.observe("timing.{}".format(name), seconds)
+        metrics.observe("timing.total", duration)
+        match = getattr(self.wsgi_request, "resolver_match", None)
+        if match is not None:
+            metrics.observe("view.{}".format(match.view_name), duration)
+        metrics.incr("sql.queries", self.queries)
+
+        if not batch_settings.ADD_DURATION_HEADER:
+            return response
+        headers = dict(response["headers"])
+        headers.update(self.get_headers(duration))
+        return dict(response, headers=headers)
@@ -0,0 +1,63 @@
+from contextlib import nullcontext
+
+from django.db import transaction
+
+# Every sub-request in its own transaction.
+PER_ITEM = "per_item"
+# Only unsafe sub-requests in their own transaction, reads run without one.
+UNSAFE_ONLY = "unsafe_only"
+# One transaction for the batch, with a savepoint per sub-request.
+SAVEPOINT = "savepoint"
+# One transaction for the batch, rolled back entirely if any sub-request fails.
+ALL_OR_NOTHING = "all_or_nothing"
+
+TRANSACTION_MODES = [PER_ITEM, UNSAFE_ONLY, SAVEPOINT, ALL_OR_NOTHING]
+
+# Modes that run the whole batch in one transaction, on the connection of the calling thread.
+OUTER_TRANSACTION_MODES = {SAVEPOINT, ALL_OR_NOTHING}
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def has_item_transaction(method, mode):
+    """
+        Returns whether a sub-request with this method runs in a transaction, or a
+        savepoint, of its own.
+
+        In savepoint mode reads get a savepoint as well, on PostgreSQL a failing query
+        would otherwise abort the transaction of the whole batch.
+    """
+    if mode == ALL_OR_NOTHING:
+        return False
+    return not (mode == UNSAFE_ONLY and method in SAFE_METHODS)
+
+
+def uses_database(view):
+    """
+        Returns whether the view function of a sub-request may use the database.
+
+        Views that don't can set `batch_uses_database = False`. They run without a
+        transaction of their own, and without taking one of the database slots of the
+        thread based executors.
+    """
+    view = getattr(view, "view_class", view)
+    return getattr(view, "batch_uses_database", True)
+
+
+def item_atomic(method, mode):
+    """
+        Returns the transaction context to run a sub-request with this method in.
+    """
+    if has_item_transaction(method, mode):
+        return transaction.atomic()
+    return nullcontext()
+
+
+class RolledBack(Exception):
+    """
+        Raised to roll back an all-or-nothing batch after a failed sub-request.
+    """
+
+    def __init__(self, index):
+        super().__init__(index)
+        self.index = index
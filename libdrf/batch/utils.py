@@ -1,7 +1,67 @@
+import copy
+import json
+import time
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import unquote_to_bytes, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIRequest
 from django.test.client import FakePayload, RequestFactory
+from django.utils.encoding import force_bytes
 
+from ..db_routers import CLIENT_ID_KEY
 from .settings import batch_settings
 
+# Attribute holding the parsed body of a sub-request, see parsers.BatchJSONParser.
+BATCH_DATA_ATTR = "batch_data"
+
+# Attribute holding the authentication shared from the batch request.
+SHARED_AUTH_ATTR = "batch_shared_auth"
+
+# Attribute holding the time it took to build a sub-request, and when it was built.
+TIMING_ATTR = "batch_timing"
+
+# WSGI environ key marking a sub-request that creates a list of items, see bulk.BulkCreateMixin.
+BULK_CREATE_KEY = "libdrf.batch.bulk_create"
+
+SharedAuth = namedtuple("SharedAuth", ["user", "auth", "authenticator_class", "header"])
+
+# Picklable description of a sub-request, to execute it in another process.
+RequestSpec = namedtuple("RequestSpec", ["environ", "body", "data", "shared_auth", "timing"])
+
+
+class BatchWSGIRequest(WSGIRequest):
+
+    """
+        WSGIRequest of a sub-request.
+
+        Records when its user is set, which DRF does once it has authenticated the
+        request, to time the authentication separately from the view.
+    """
+    authenticated_at = None
+
+    @property
+    def user(self):
+        try:
+            return self.__dict__["user"]
+        except KeyError:
+            raise AttributeError("user")
+
+    @user.setter
+    def user(self, value):
+        self.__dict__["user"] = value
+        self.authenticated_at = time.perf_counter()
+
+
+def get_path_info(path):
+    """
+        Returns the PATH_INFO for a path, unquoted and decoded as latin-1 as WSGI requires.
+    """
+    return unquote_to_bytes(path).decode("iso-8859-1")
+
 
 class BatchRequestFactory(RequestFactory):
 
@@ -40,40 +100,39 @@ class BatchRequestFactory(RequestFactory):
         return environ
 
 
+# Standard WSGI supported headers
+WSGI_HEADERS = {
+    "content_length",
+    "content_type",
+    "query_string",
+    "remote_addr",
+    "remote_host",
+    "remote_user",
+    "request_method",
+    "server_name",
+    "server_port",
+}
+
+
+@lru_cache(maxsize=512)
+def transform_header(header):
+    """
+        Replace - to _, prepend HTTP_ if necessary and convert to upper case.
+        Header names repeat across sub-requests, so the result is cached.
+    """
+    header = header.replace("-", "_")
+    if header.lower() not in WSGI_HEADERS:
+        header = "http_{header}".format(header=header)
+    return header.upper()
+
+
 def pre_process_method_headers(method, headers):
     """
         Returns the lowered method.
         Capitalize headers, prepend HTTP_ and change - to _.
     """
     method = method.lower()
-
-    # Standard WSGI supported headers
-    _wsgi_headers = [
-        "content_length",
-        "content_type",
-        "query_string",
-        "remote_addr",
-        "remote_host",
-        "remote_user",
-        "request_method",
-        "server_name",
-        "server_port",
-    ]
-
-    _transformed_headers = {}
-
-    # For every header, replace - to _, prepend http_ if necessary and convert
-    # to upper case.
-    for header, value in headers.items():
-
-        header = header.replace("-", "_")
-        header = (
-            "http_{header}".format(header=header)
-            if header.lower() not in _wsgi_headers
-            else header
-        )
-        _transformed_headers.update({header.upper(): value})
-
+    _transformed_headers = {transform_header(header): value for header, value in headers.items()}
     return method, _transformed_headers
 
 
@@ -86,29 +145,141 @@ def headers_to_include_from_request(curr_request):
     }
 
 
-def get_wsgi_request_object(curr_request, method, path, headers, body):
+def is_json_content_type(content_type):
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type == "application/json" or media_type.endswith("+json")
+
+
+class BatchRequestBuilder(object):
+
     """
-        Based on the given request parameters, constructs and returns the WSGI request object.
+        Constructs the WSGI requests for the items of one batch.
+
+        The base environ, including the headers passed on from the batch request,
+        is computed once per batch. Every item only overlays its own method, path,
+        headers and body.
+
+        When given a SharedAuth, it is attached to the sub-requests that carry the
+        same Authorization header as the batch request.
     """
-    x_headers = headers_to_include_from_request(curr_request)
-    method, t_headers = pre_process_method_headers(method, headers)
 
-    # Add default content type.
-    if "CONTENT_TYPE" not in t_headers:
-        t_headers.update({"CONTENT_TYPE": batch_settings.DEFAULT_CONTENT_TYPE})
+    def __init__(self, curr_request, shared_auth=None):
+        self.shared_auth = shared_auth
+        self.factory = BatchRequestFactory()
+        secure = batch_settings.USE_HTTPS
 
-    # Override existing batch requests headers with the new headers passed for this request.
-    x_headers.update(t_headers)
+        environ = self.factory._base_environ()
+        environ.update(
+            {
+                "SERVER_PORT": "443" if secure else "80",
+                "wsgi.url_scheme": "https" if secure else "http",
+                "CONTENT_TYPE": batch_settings.DEFAULT_CONTENT_TYPE,
+            }
+        )
+        environ.update(headers_to_include_from_request(curr_request))
+        # Lets the database router keep the sub-requests after a write on the primary.
+        environ[CLIENT_ID_KEY] = uuid.uuid4().hex
+        self.base_environ = environ
 
-    content_type = x_headers.get("CONTENT_TYPE", batch_settings.DEFAULT_CONTENT_TYPE)
+    def get_environ(self, method, path, headers, body):
+        """
+            Returns the WSGI environ for a sub-request, and its parsed body if any.
+        """
+        parsed = urlsplit(path)
+        environ = self.base_environ.copy()
+        environ.update(
+            {
+                "PATH_INFO": get_path_info(parsed.path),
+                "REQUEST_METHOD": method.upper(),
+                "wsgi.input": FakePayload(b""),
+            }
+        )
+
+        data = None
+        if isinstance(body, (dict, list)):
+            # A copy, views may modify request.data.
+            data, body = copy.deepcopy(body), json.dumps(body, separators=(",", ":"))
+        if body:
+            body = force_bytes(body, settings.DEFAULT_CHARSET)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            environ["wsgi.input"] = FakePayload(body)
+
+        # Override the batch request headers with the headers passed for this request.
+        for header, value in headers.items():
+            environ[transform_header(header)] = value
+
+        # If QUERY_STRING is absent or empty, extract it from the path.
+        if not environ.get("QUERY_STRING"):
+            # WSGI requires latin-1 encoded strings.
+            environ["QUERY_STRING"] = parsed.query.encode().decode("iso-8859-1")
 
-    # Get hold of request factory to construct the request.
-    _request_factory = BatchRequestFactory()
-    _request_provider = getattr(_request_factory, method)
+        if data is not None and not is_json_content_type(environ["CONTENT_TYPE"]):
+            data = None
+        return environ, data
 
-    secure = batch_settings.USE_HTTPS
-    request = _request_provider(
-        path, data=body, secure=secure, content_type=content_type, **x_headers
+    def build(self, method, path, headers, body):
+        """
+            Based on the given request parameters, constructs and returns the WSGI request object.
+
+            The body may be passed already parsed. For JSON content types a copy of it
+            is then attached to the request, so BatchJSONParser can hand it to the
+            view without decoding it again.
+        """
+        start = time.perf_counter()
+        environ, data = self.get_environ(method, path, headers, body)
+        request = BatchWSGIRequest(environ)
+        if data is not None:
+            setattr(request, BATCH_DATA_ATTR, data)
+        if self.shared_auth and environ.get("HTTP_AUTHORIZATION") == self.shared_auth.header:
+            setattr(request, SHARED_AUTH_ATTR, self.shared_auth)
+        built_at = time.perf_counter()
+        setattr(request, TIMING_ATTR, {"build": built_at - start, "built_at": built_at})
+        return request
+
+
+def get_wsgi_request_object(curr_request, method, path, headers, body):
+    """
+        Based on the given request parameters, constructs and returns the WSGI request object.
+
+        Prefer a BatchRequestBuilder when constructing several requests for the
+        same batch.
+    """
+    return BatchRequestBuilder(curr_request).build(method, path, headers, body)
+
+
+def get_request_spec(wsgi_request):
+    """
+        Returns the RequestSpec of a sub-request: its string WSGI environ variables,
+        the body, the parsed body and the shared authentication, with the user
+        replaced by its id.
+    """
+    environ = {key: value for key, value in wsgi_request.environ.items() if isinstance(value, str)}
+    shared_auth = getattr(wsgi_request, SHARED_AUTH_ATTR, None)
+    if shared_auth is not None:
+        shared_auth = shared_auth._replace(user=shared_auth.user.pk)
+    return RequestSpec(
+        environ,
+        wsgi_request.body,
+        getattr(wsgi_request, BATCH_DATA_ATTR, None),
+        shared_auth,
+        getattr(wsgi_request, TIMING_ATTR, None),
     )
 
+
+def get_request_from_spec(spec):
+    """
+        Constructs the WSGI request object described by a RequestSpec.
+    """
+    environ = BatchRequestFactory()._base_environ()
+    environ.update(spec.environ)
+    environ["wsgi.input"] = FakePayload(spec.body)
+    request = BatchWSGIRequest(environ)
+    if spec.timing is not None:
+        setattr(request, TIMING_ATTR, spec.timing)
+    if spec.data is not None:
+        setattr(request, BATCH_DATA_ATTR, spec.data)
+    if spec.shared_auth is not None:
+        user = get_user_model()._default_manager.filter(pk=spec.shared_auth.user).first()
+        if user is not None:
+            setattr(request, SHARED_AUTH_ATTR, spec.shared_auth._replace(user=user))
     return request
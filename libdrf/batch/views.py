@@ -1,52 +1,174 @@
+import copy
 import json
 import logging
+import math
+import time
+from contextlib import contextmanager, nullcontext
+from http import HTTPStatus
+from operator import itemgetter
 
-from django.db import transaction
-from django.http.response import HttpResponseNotFound, HttpResponseServerError
-from django.urls import resolve
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.db import close_old_connections, transaction
+from django.http.response import (HttpResponse, HttpResponseNotFound,
+                                  HttpResponseServerError,
+                                  StreamingHttpResponse)
 from django.urls.exceptions import Resolver404
-from rest_framework import generics, permissions
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from .exceptions import BadBatchRequest
-from .serializers import BatchRequestSerializer, BatchResponseSerializer
+from ..db_routers import route_request
+from .bulk import get_bulk_key, split_bulk_response
+from .cache import (acache_response, aget_cached_response, cache_response,
+                    get_cache_key, get_cache_timeout, get_cached_response,
+                    get_dedupe_key, get_write_epochs)
+from .compression import compress_response
+from .conditional import (conditional_response, get_not_modified,
+                          get_version_etag, get_version_function)
+from .dependencies import get_last_uses, get_layers, resolve_references
+from .exceptions import BadBatchRequest, BatchTimeout, FailedDependency
+from .executors import SequentialExecutor
+from .idempotency import (REPLAYED_HEADER, execute_once, get_fingerprint,
+                          get_idempotency_key)
+from .metrics import metrics
+from .parsers import OPTIONAL_PARSERS
+from .renderers import (OPTIONAL_RENDERERS, BatchJSONRenderer, NDJSONRenderer,
+                        RawJSON)
+from .resolvers import resolver_cache
+from .serializers import (BatchRequestSerializer, BatchResponseItemSerializer,
+                          BatchResponseSerializer,
+                          BatchTemplateRequestSerializer)
 from .settings import batch_settings
-from .utils import get_wsgi_request_object
+from .templates import templates
+from .timing import Timer
+from .transactions import (ALL_OR_NOTHING, OUTER_TRANSACTION_MODES, PER_ITEM,
+                           RolledBack, has_item_transaction, item_atomic,
+                           uses_database)
+from .utils import (BULK_CREATE_KEY, SHARED_AUTH_ATTR, BatchRequestBuilder,
+                    SharedAuth)
 
 logger = logging.getLogger(__name__)
 
 
-def get_deserialized_response(wsgi_request):
-    # Get the view / handler for this request
+def resolve_request(wsgi_request):
+    """
+        Returns the (view, args, kwargs) for this request, or None if no view matches.
+    """
     try:
-        view, args, kwargs = resolve(wsgi_request.path_info)
-    except Resolver404 as exc:
-        resp = HttpResponseNotFound()
+        match = resolver_cache.resolve(wsgi_request.path_info)
+    except Resolver404:
+        return None
+    wsgi_request.resolver_match = match
+    return match
 
-    else:
-        kwargs.update({"request": wsgi_request})
 
-        # Let the view do his task.
-        try:
-            with transaction.atomic():
-                resp = view(*args, **kwargs)
-        except Exception as exc:
-            logger.exception("Batch request server error")
-            resp = HttpResponseServerError()
+def share_authentication(wsgi_request, match):
+    """
+        Force the authentication of the batch request on a sub-request, if the
+        sub-request carries the same credentials and its view authenticates with
+        the same authentication class.
+    """
+    shared_auth = getattr(wsgi_request, SHARED_AUTH_ATTR, None)
+    view_class = getattr(match.func, "cls", None) if match else None
+    if shared_auth is None or view_class is None:
+        return
+    if shared_auth.authenticator_class not in getattr(view_class, "authentication_classes", ()):
+        return
 
-    headers = resp.headers.copy()
+    # DRF picks these up when wrapping the request, and skips the authenticators.
+    wsgi_request._force_auth_user = copy.copy(shared_auth.user)
+    wsgi_request._force_auth_token = shared_auth.auth
 
-    # Convert HTTP response into simple dict type.
-    d_resp = {
-        "status_code": resp.status_code,
-        "reason_phrase": resp.reason_phrase,
-        "headers": headers,
-        "path": wsgi_request.get_full_path(),
-    }
+
+@contextmanager
+def view_context(wsgi_request, transaction_mode=PER_ITEM, timer=None, database=True):
+    """
+        The context the view of a sub-request runs in: its transaction depending on
+        the transaction mode of the batch, replica routing with ReplicaRouter, and the
+        timing of the view and its queries.
+    """
+    timed = timer.view(wsgi_request) if timer else nullcontext()
+    counted = timer.count_queries() if timer else nullcontext()
+    atomic = item_atomic(wsgi_request.method, transaction_mode) if database else nullcontext()
+    with route_request(wsgi_request), timed, counted, atomic:
+        yield
+
+
+def get_view_response(wsgi_request, match, transaction_mode=PER_ITEM, timer=None):
+    """
+        Call the resolved view for this request, within view_context.
+    """
+    if match is None:
+        return HttpResponseNotFound()
+
+    view, args, kwargs = match
+
+    # Let the view do his task.
+    try:
+        with view_context(wsgi_request, transaction_mode, timer, uses_database(view)):
+            return view(wsgi_request, *args, **kwargs)
+    except Exception:
+        logger.exception("Batch request server error")
+        return HttpResponseServerError()
+
+
+def run_view_in_thread(wsgi_request, match, transaction_mode=PER_ITEM, timer=None):
+    """
+        get_view_response for the async batch view, on a thread of its own. Like the
+        thread based executors, the connections of the thread are managed like Django
+        does for requests.
+    """
+    if batch_settings.ASYNC_THREAD_SENSITIVE:
+        return get_view_response(wsgi_request, match, transaction_mode, timer)
+    close_old_connections()
+    try:
+        return get_view_response(wsgi_request, match, transaction_mode, timer)
+    finally:
+        close_old_connections()
+
+
+async def aget_view_response(wsgi_request, match, transaction_mode=PER_ITEM, timer=None):
+    """
+        Async counterpart of get_view_response.
+
+        Sync views run in a thread through sync_to_async. So do async views that need a
+        transaction of their own: the queries of an async view run through sync_to_async,
+        and reach the transaction's thread through async_to_sync. Other async views are
+        awaited on the event loop, their queries aren't counted in the SQL timing.
+    """
+    if match is not None and iscoroutinefunction(match.func):
+        view, args, kwargs = match
+        database = uses_database(view)
+        if database and has_item_transaction(wsgi_request.method, transaction_mode):
+            match = (async_to_sync(view), args, kwargs)
+        else:
+            try:
+                with view_context(wsgi_request, transaction_mode, timer, database):
+                    return await view(wsgi_request, *args, **kwargs)
+            except Exception:
+                logger.exception("Batch request server error")
+                return HttpResponseServerError()
+    return await sync_to_async(
+        run_view_in_thread, thread_sensitive=batch_settings.ASYNC_THREAD_SENSITIVE
+    )(wsgi_request, match, transaction_mode, timer)
+
+
+def serialize_response(wsgi_request, resp, raw=False):
+    """
+        Convert HTTP response into simple dict type.
+
+        With raw, rendered JSON bodies are kept as RawJSON bytes instead of being
+        parsed, so the batch renderers can splice them into the output as is.
+    """
     if hasattr(resp, "render"):
         resp.render()
         if not resp.content:
             body = None
+        elif raw and resp.get("Content-Type", "").startswith("application/json"):
+            body = RawJSON(resp.content)
         else:
             body = json.loads(resp.content)
     else:
@@ -54,38 +176,751 @@ def get_deserialized_response(wsgi_request):
             body = None
         else:
             body = str(resp.content, "utf8")
-    d_resp.update({"body": body})
 
-    return d_resp
+    return {
+        "status_code": resp.status_code,
+        "reason_phrase": resp.reason_phrase,
+        "body": body,
+        "headers": dict(resp.headers),
+        "path": wsgi_request.get_full_path(),
+    }
 
 
-class BatchRequestView(generics.GenericAPIView):
-    permission_classes = [permissions.AllowAny]
+def get_error_response(path, status_code, detail):
+    """
+        Returns a sub-response for a request that could not be executed.
+    """
+    return {
+        "status_code": status_code,
+        "reason_phrase": HTTPStatus(status_code).phrase,
+        "headers": {},
+        "path": path,
+        "body": {"detail": detail},
+    }
 
-    def post(self, *args, **kwargs):
 
-        serializer = BatchRequestSerializer(data=self.request.data)
+def get_deserialized_response(wsgi_request, raw=False, transaction_mode=PER_ITEM):
+    timer = Timer(wsgi_request)
+
+    # Get the view / handler for this request
+    with timer.step("resolve"):
+        match = resolve_request(wsgi_request)
+
+    # Skip the view if the client has the current version already.
+    etag = get_version_etag(wsgi_request, match)
+    not_modified = get_not_modified(wsgi_request, etag)
+    if not_modified is not None:
+        return timer.finish(serialize_response(wsgi_request, not_modified))
+
+    cache_timeout = get_cache_timeout(wsgi_request, match)
+    if cache_timeout:
+        cache_key = get_cache_key(wsgi_request, match, raw=raw)
+        response = get_cached_response(cache_key)
+        if response is not None:
+            not_modified = get_not_modified(wsgi_request, response["headers"].get("ETag"))
+            if not_modified is not None:
+                response = serialize_response(wsgi_request, not_modified)
+            return timer.finish(response)
+
+    share_authentication(wsgi_request, match)
+    resp = get_view_response(wsgi_request, match, transaction_mode, timer)
+    with timer.step("render"):
+        resp = conditional_response(wsgi_request, resp, etag)
+        response = serialize_response(wsgi_request, resp, raw=raw)
+    if cache_timeout:
+        cache_response(cache_key, response, cache_timeout)
+    return timer.finish(response)
+
+
+async def aget_deserialized_response(wsgi_request, raw=False, transaction_mode=PER_ITEM):
+    """
+        Async counterpart of get_deserialized_response.
+
+        Async views are awaited on the running event loop, sync views are run
+        through sync_to_async.
+    """
+    timer = Timer(wsgi_request)
+    with timer.step("resolve"):
+        match = resolve_request(wsgi_request)
+
+    # The version function may query the database.
+    etag = None
+    if get_version_function(wsgi_request, match) is not None:
+        etag = await sync_to_async(get_version_etag)(wsgi_request, match)
+    not_modified = get_not_modified(wsgi_request, etag)
+    if not_modified is not None:
+        return timer.finish(serialize_response(wsgi_request, not_modified))
+
+    cache_timeout = get_cache_timeout(wsgi_request, match)
+    if cache_timeout:
+        cache_key = get_cache_key(wsgi_request, match, raw=raw)
+        response = await aget_cached_response(cache_key)
+        if response is not None:
+            not_modified = get_not_modified(wsgi_request, response["headers"].get("ETag"))
+            if not_modified is not None:
+                response = serialize_response(wsgi_request, not_modified)
+            return timer.finish(response)
+
+    share_authentication(wsgi_request, match)
+    resp = await aget_view_response(wsgi_request, match, transaction_mode, timer)
+    with timer.step("render"):
+        resp = conditional_response(wsgi_request, resp, etag)
+        response = serialize_response(wsgi_request, resp, raw=raw)
+    if cache_timeout:
+        await acache_response(cache_key, response, cache_timeout)
+    return timer.finish(response)
+
+
+class LayerExecution(object):
+    """
+        A layer of sub-requests being executed. The batch view runs its requests on
+        an executor and hands their results back. They are recorded in the responses
+        of the batch, and the (index, response) pairs to yield are returned, including
+        the copies for the duplicates of the requests.
+    """
+
+    def __init__(self, view, specs, groups, requests, failed, responses, duplicates, timeout):
+        self.view = view
+        self.specs = specs
+        self.groups = groups
+        self.requests = requests
+        self.failed = failed
+        self.responses = responses
+        self.duplicates = duplicates
+        self.timeout = timeout
+
+    def start(self):
+        """
+            Returns the responses known before executing anything: the failed
+            dependencies, and timeouts for all the requests if no time is left.
+        """
+        results = self.record(self.failed)
+        if self.timeout == 0:
+            results.extend(self.time_out(range(len(self.groups))))
+            self.requests = []
+        return results
+
+    def complete(self, pos, response):
+        """
+            Records the response to the request at pos, or a timeout if the executor
+            gave up on it.
+        """
+        group = self.groups[pos]
+        if isinstance(response, BatchTimeout):
+            return self.record(self.view.get_timeout_responses(self.specs, group))
+        return self.record(self.view.split_response(self.specs, group, response))
+
+    def time_out(self, positions):
+        indices = [index for pos in positions for index in self.groups[pos]]
+        return self.record(self.view.get_timeout_responses(self.specs, indices))
+
+    def record(self, items):
+        results = []
+        for index, response in items:
+            self.responses[index] = response
+            results.append((index, response))
+        results.extend(self.view.copy_duplicates(self.responses, self.duplicates))
+        return results
+
+
+class BatchRequestMixin:
+    """
+        Shared request handling for the sync and async batch views.
+    """
+    # One of transactions.TRANSACTION_MODES, defaults to TRANSACTION_MODE.
+    transaction_mode = None
+    # Executor of the sync view, defaults to the configured executor.
+    executor = None
+
+    def get_limit(self, streaming=False):
+        """
+            Returns the maximum number of requests in a batch. Streamed batches may
+            be larger, up to LARGE_BATCH_LIMIT.
+        """
+        if streaming and batch_settings.LARGE_BATCH_LIMIT:
+            return max(batch_settings.LARGE_BATCH_LIMIT, batch_settings.MAX_LIMIT)
+        return batch_settings.MAX_LIMIT
+
+    def check_limit(self, data, streaming=False):
+        """
+            Check the size of the batch before validating and building anything.
+        """
+        requests = data.get("requests") if isinstance(data, dict) else None
+        limit = self.get_limit(streaming)
+        if not isinstance(requests, list) or len(requests) <= limit:
+            return
+        detail = "You can batch maximum of {} requests.".format(limit)
+        if not streaming and self.get_limit(streaming=True) > limit:
+            detail = "You can batch maximum of {} requests, or {} when streaming the responses as {}.".format(
+                limit, self.get_limit(streaming=True), NDJSONRenderer.media_type
+            )
+        raise BadBatchRequest(detail)
+
+    def get_batch_specs(self, data, streaming=False):
+        """
+            Validate the batch payload and return the sub-request specs.
+        """
+        if isinstance(data, dict) and "template" in data:
+            return self.get_template_specs(data)
+        self.check_limit(data, streaming)
+        serializer = BatchRequestSerializer(data=data)
         serializer.is_valid(raise_exception=True)
         specs = serializer.validated_data["requests"]
+        if "transaction" in serializer.validated_data:
+            self.transaction_mode = serializer.validated_data["transaction"]
 
         paths = ["{} {}".format(req["method"].upper(), req["path"]) for req in specs]
         logger.info("Batch requests:\n    {}".format("\n    ".join(paths)))
-        requests = [
-            get_wsgi_request_object(
-                self.request,
-                req["method"],
-                req["path"],
-                req.get("headers", {}),
-                json.dumps(req["body"]) if req.get("body") else None,
-            )
-            for req in specs
+        return specs
+
+    def get_template_specs(self, data):
+        """
+            Returns the sub-request specs of a named batch template from the TEMPLATES
+            setting, with the parameters of the payload filled in.
+        """
+        serializer = BatchTemplateRequestSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        template = templates.get(serializer.validated_data["template"])
+        specs = template.render(serializer.validated_data.get("params", {}))
+        if template.transaction_mode:
+            self.transaction_mode = template.transaction_mode
+        if template.executor is not None:
+            self.executor = template.executor
+
+        logger.info("Batch template: {}".format(template.name))
+        return specs
+
+    def get_chunks(self, specs):
+        """
+            Split the batch into chunks of CHUNK_SIZE consecutive sub-requests, executed
+            one after the other to bound the number of requests and responses held.
+        """
+        size = batch_settings.CHUNK_SIZE or len(specs) or 1
+        return [range(start, min(start + size, len(specs))) for start in range(0, len(specs), size)]
+
+    def prune_responses(self, responses, last_uses, done):
+        """
+            Drop the responses that no request after index done depends on.
+        """
+        for index in list(responses):
+            if last_uses.get(index, -1) <= done:
+                del responses[index]
+
+    def get_transaction_mode(self):
+        return self.transaction_mode or batch_settings.TRANSACTION_MODE
+
+    def get_executor(self):
+        return self.executor or batch_settings.executor
+
+    def get_shared_auth(self, request):
+        """
+            Returns the authentication of the batch request to reuse for the
+            sub-requests, if enabled through SHARE_AUTHENTICATION.
+        """
+        if not batch_settings.SHARE_AUTHENTICATION:
+            return None
+        authenticator = getattr(request, "successful_authenticator", None)
+        header = request.META.get("HTTP_AUTHORIZATION")
+        if authenticator is None or not header:
+            return None
+        return SharedAuth(request.user, request.auth, type(authenticator), header)
+
+    def get_request_builder(self, request):
+        return BatchRequestBuilder(request, shared_auth=self.get_shared_auth(request))
+
+    def build_request(self, builder, spec):
+        """
+            Based on the given sub-request spec, constructs the WSGI request object.
+        """
+        return builder.build(
+            spec["method"],
+            spec["path"],
+            spec.get("headers", {}),
+            spec.get("body") or None,
+        )
+
+    def build_bulk_request(self, builder, specs):
+        """
+            Constructs a single WSGI request creating the bodies of all the specs.
+        """
+        request = builder.build(
+            "post", specs[0]["path"], specs[0].get("headers", {}), [spec["body"] for spec in specs]
+        )
+        request.META[BULK_CREATE_KEY] = "1"
+        return request
+
+    def prepare_layer(self, builder, specs, layer, responses, duplicates, epochs=None):
+        """
+            Fill in the references to earlier results for a layer of sub-requests.
+
+            Returns the groups of indices and the WSGI request to execute for each group,
+            and the (index, response) pairs for the requests whose dependencies failed.
+            A group is a single request, or with COALESCE_BULK_CREATE consecutive creates
+            coalesced into a bulk create. With DEDUPE_REQUESTS, identical safe requests
+            are executed once, the others are added to duplicates, a dict of
+            {dedupe key: [index, duplicate index, ...]}. Only requests with the same
+            write epoch, see get_write_epochs, are identical.
+        """
+        runnable, failed = [], []
+        for index in layer:
+            try:
+                spec = resolve_references(specs[index], responses)
+            except FailedDependency as exc:
+                response = get_error_response(
+                    specs[index]["path"], status.HTTP_424_FAILED_DEPENDENCY, str(exc)
+                )
+                failed.append((index, response))
+                continue
+
+            key = None
+            if batch_settings.DEDUPE_REQUESTS:
+                key = get_dedupe_key(spec, epochs[index] if epochs else 0)
+            if key is not None and key in duplicates:
+                duplicates[key].append(index)
+                metrics.incr("dedupe.hits")
+                continue
+            if key is not None:
+                duplicates[key] = [index]
+            runnable.append((index, spec))
+
+        runs = []
+        for index, spec in runnable:
+            key = get_bulk_key(spec) if batch_settings.COALESCE_BULK_CREATE else None
+            if key is not None and runs and runs[-1][0] == key:
+                runs[-1][1].append((index, spec))
+            else:
+                runs.append((key, [(index, spec)]))
+
+        groups, requests = [], []
+        for key, items in runs:
+            groups.append([index for index, spec in items])
+            if len(items) == 1:
+                requests.append(self.build_request(builder, items[0][1]))
+            else:
+                requests.append(self.build_bulk_request(builder, [spec for index, spec in items]))
+                metrics.incr("bulk_create.coalesced", len(items))
+        return groups, requests, failed
+
+    def split_response(self, specs, group, response):
+        """
+            Yields the (index, response) pairs for the response to a group of requests.
+        """
+        if len(group) == 1:
+            yield group[0], response
+        else:
+            yield from split_bulk_response(specs, group, response)
+
+    def copy_duplicates(self, responses, duplicates):
+        """
+            Yields (index, response) pairs for the duplicates of the executed requests.
+        """
+        for index, *others in duplicates.values():
+            if index not in responses:
+                continue
+            for other in others:
+                if other not in responses:
+                    responses[other] = dict(responses[index])
+                    yield other, responses[other]
+
+    def get_deadline(self, request):
+        """
+            Returns the time.monotonic() by which the batch has to be done, or None.
+
+            The TIMEOUT setting can be shortened by the client with TIMEOUT_HEADER, to at
+            most TIMEOUT_HEADER_MAX seconds.
+        """
+        timeouts = [batch_settings.TIMEOUT] if batch_settings.TIMEOUT is not None else []
+        header = batch_settings.TIMEOUT_HEADER and request.META.get(batch_settings.TIMEOUT_HEADER)
+        if header:
+            try:
+                timeout = float(header)
+            except ValueError:
+                timeout = None
+            if timeout is not None and math.isfinite(timeout) and timeout >= 0:
+                if batch_settings.TIMEOUT_HEADER_MAX is not None:
+                    timeout = min(timeout, batch_settings.TIMEOUT_HEADER_MAX)
+                timeouts.append(timeout)
+        if not timeouts:
+            return None
+        return time.monotonic() + min(timeouts)
+
+    def get_layer_timeout(self, deadline):
+        """
+            Returns the number of seconds the next layer of sub-requests can take, or None.
+
+            LAYER_TIMEOUT bounds a whole layer from when it is dispatched, items queued
+            behind busy workers share the same budget. ITEM_TIMEOUT is enforced by the
+            executors, from when each sub-request starts running.
+        """
+        timeouts = []
+        if batch_settings.LAYER_TIMEOUT is not None:
+            timeouts.append(batch_settings.LAYER_TIMEOUT)
+        if deadline is not None:
+            timeouts.append(max(deadline - time.monotonic(), 0))
+        return min(timeouts) if timeouts else None
+
+    def get_timeout_responses(self, specs, indices):
+        return [
+            (index, get_error_response(
+                specs[index]["path"], status.HTTP_504_GATEWAY_TIMEOUT, "Request timed out."
+            ))
+            for index in indices
         ]
 
-        num_requests = len(requests)
-        if num_requests > batch_settings.MAX_LIMIT:
-            raise BadBatchRequest(
-                "You can batch maximum of {} requests.".format(batch_settings.MAX_LIMIT)
+    def iter_layers(self, request, specs):
+        """
+            Yields a LayerExecution for every layer of sub-requests, once the layers
+            before it are done. Large batches are executed in chunks, keeping only the
+            responses that later requests depend on.
+
+            Shared by the sync and async views, which only differ in how they run the
+            requests of a layer.
+        """
+        deadline = self.get_deadline(request)
+        builder = self.get_request_builder(request)
+        last_uses = get_last_uses(specs)
+        epochs = get_write_epochs(specs)
+        responses = {}
+        for chunk in self.get_chunks(specs):
+            duplicates = {}
+            for layer in get_layers(specs, chunk):
+                groups, requests, failed = self.prepare_layer(
+                    builder, specs, layer, responses, duplicates, epochs
+                )
+                yield LayerExecution(
+                    self, specs, groups, requests, failed, responses, duplicates,
+                    self.get_layer_timeout(deadline),
+                )
+            self.prune_responses(responses, last_uses, chunk[-1])
+
+    def execute_layers(self, request, specs, executor, raw=False, transaction_mode=PER_ITEM):
+        """
+            Execute the sub-requests layer by layer, running each layer in parallel on
+            the executor. Yields (index, response) pairs as they complete.
+
+            Sub-requests that don't complete in time get a 504 response.
+        """
+        for layer in self.iter_layers(request, specs):
+            yield from layer.start()
+            if not layer.requests:
+                continue
+            try:
+                for pos, response in executor.execute_as_completed(
+                    layer.requests, get_deserialized_response, raw=raw,
+                    transaction_mode=transaction_mode, timeout=layer.timeout,
+                    item_timeout=batch_settings.ITEM_TIMEOUT
+                ):
+                    yield from layer.complete(pos, response)
+            except BatchTimeout as exc:
+                yield from layer.time_out(exc.indices)
+
+    def execute_batch(self, request, specs, raw=False):
+        """
+            Execute the sub-requests on the configured executor, within the transaction
+            mode of the batch. Yields (index, response) pairs as they complete.
+        """
+        mode = self.get_transaction_mode()
+        if mode not in OUTER_TRANSACTION_MODES:
+            yield from self.execute_layers(
+                request, specs, self.get_executor(), raw=raw, transaction_mode=mode
+            )
+            return
+        yield from self.execute_in_transaction(request, specs, raw=raw, transaction_mode=mode)
+
+    def execute_in_transaction(self, request, specs, raw=False, transaction_mode=ALL_OR_NOTHING):
+        """
+            Execute the sub-requests in a single transaction, committed once for the batch.
+
+            The transaction belongs to the connection of this thread, so the sub-requests
+            run sequentially. The responses are only returned once committed. If a
+            sub-request of an all-or-nothing batch fails, everything is rolled back and
+            the other sub-requests get a 424 response.
+        """
+        results = []
+        try:
+            with transaction.atomic():
+                for index, response in self.execute_layers(
+                    request, specs, SequentialExecutor(), raw=raw,
+                    transaction_mode=transaction_mode
+                ):
+                    results.append((index, response))
+                    if transaction_mode == ALL_OR_NOTHING and response["status_code"] >= 400:
+                        raise RolledBack(index)
+        except RolledBack as exc:
+            failed = dict(results)[exc.index]
+            detail = "Batch rolled back, request {} failed.".format(exc.index)
+            results = [
+                (index, failed if index == exc.index else get_error_response(
+                    spec["path"], status.HTTP_424_FAILED_DEPENDENCY, detail
+                ))
+                for index, spec in enumerate(specs)
+            ]
+        return results
+
+    async def aexecute_batch(self, request, specs, raw=False):
+        """
+            Async counterpart of execute_batch.
+        """
+        mode = self.get_transaction_mode()
+        if mode in OUTER_TRANSACTION_MODES:
+            results = await sync_to_async(self.execute_in_transaction)(
+                request, specs, raw=raw, transaction_mode=mode
+            )
+            for index, response in results:
+                yield index, response
+            return
+
+        executor = batch_settings.async_executor
+        for layer in self.iter_layers(request, specs):
+            for index, response in layer.start():
+                yield index, response
+            if not layer.requests:
+                continue
+            try:
+                async for pos, response in executor.execute_as_completed(
+                    layer.requests, aget_deserialized_response, raw=raw, transaction_mode=mode,
+                    timeout=layer.timeout, item_timeout=batch_settings.ITEM_TIMEOUT
+                ):
+                    for index, item in layer.complete(pos, response):
+                        yield index, item
+            except BatchTimeout as exc:
+                for index, response in layer.time_out(exc.indices):
+                    yield index, response
+
+    def collect_responses(self, results):
+        """
+            Order the (index, response) pairs by their index.
+        """
+        return [response for index, response in sorted(results, key=itemgetter(0))]
+
+    def get_response_data(self, responses):
+        """
+            Returns the batch response data, with the headers of the sub-responses
+            reduced as set by HEADERS:
+
+            - all: every sub-response keeps its headers
+            - none: the headers are left out
+            - dedupe: the headers common to all sub-responses are moved to `headers`
+        """
+        mode = batch_settings.HEADERS
+        if mode == "none":
+            return {"responses": [self.without_headers(response) for response in responses]}
+        if mode == "dedupe" and responses:
+            common = {
+                header: value for header, value in responses[0]["headers"].items()
+                if all(response["headers"].get(header) == value for response in responses)
+            }
+            responses = [
+                dict(response, headers={
+                    header: value for header, value in response["headers"].items()
+                    if header not in common
+                })
+                for response in responses
+            ]
+            return {"headers": common, "responses": responses}
+        return {"responses": responses}
+
+    def without_headers(self, response):
+        return {key: value for key, value in response.items() if key != "headers"}
+
+    def render_stream_line(self, index, response, raw=False):
+        """
+            Render a single sub-response as an NDJSON line tagged with its index.
+
+            Headers can't be deduplicated while streaming, only left out.
+        """
+        if batch_settings.HEADERS == "none":
+            response = self.without_headers(response)
+        if raw:
+            data = {"index": index, **response}
+        else:
+            data = BatchResponseItemSerializer(dict(response, index=index)).data
+        return NDJSONRenderer().render_line(data)
+
+    def stream_responses(self, request, specs):
+        raw = batch_settings.RAW_RESPONSE_ASSEMBLY
+        for index, response in self.execute_batch(request, specs, raw=raw):
+            yield self.render_stream_line(index, response, raw=raw)
+
+    async def astream_responses(self, request, specs):
+        raw = batch_settings.RAW_RESPONSE_ASSEMBLY
+        async for index, response in self.aexecute_batch(request, specs, raw=raw):
+            yield self.render_stream_line(index, response, raw=raw)
+
+
+class BatchRequestView(BatchRequestMixin, generics.GenericAPIView):
+    """
+        Execute a batch of requests in one call.
+
+        With SHARE_AUTHENTICATION, the batch request is authenticated once and
+        sub-requests with the same Authorization header reuse its user and auth.
+
+        Sub-requests can use the results of earlier ones by referencing them in
+        their path, headers or body, e.g. `/items/{result=0:$.body.id}/children`.
+        Independent sub-requests run in parallel layers on the configured executor.
+
+        The TRANSACTION_MODE setting, or the `transaction` of a batch, decides how the
+        sub-requests are wrapped in transactions: one per item, only for unsafe methods,
+        a single transaction with savepoints, or all-or-nothing.
+
+        With TIMEOUT, LAYER_TIMEOUT, ITEM_TIMEOUT or a client supplied TIMEOUT_HEADER,
+        sub-requests that don't complete in time get a 504 response and queued ones are
+        cancelled. LAYER_TIMEOUT applies to each layer of independent sub-requests as a
+        whole, ITEM_TIMEOUT to each sub-request from when it starts running.
+
+        With ADD_DURATION_HEADER, every sub-response carries its duration. With
+        SERVER_TIMING as well, a Server-Timing header with the time spent queued,
+        building, resolving, authenticating, in the view, rendering and in SQL queries.
+
+        With ETAGS, successful GET sub-responses carry an ETag, and sub-requests with a
+        matching If-None-Match get a body-less 304 response. Views can define a cheap
+        `batch_version` to skip the view entirely in that case.
+
+        With COALESCE_BULK_CREATE, consecutive creates to a view with BulkCreateMixin
+        are written with a single bulk_create.
+
+        With DEDUPE_REQUESTS, identical safe sub-requests without a write between them
+        are executed once per batch. Views can opt in to
+        a short-lived response cache shared between batches with `batch_cache_timeout`.
+
+        Clients accepting `application/x-ndjson` get a streaming response with
+        one line per sub-response, written as soon as each one completes. Streamed
+        batches may hold up to LARGE_BATCH_LIMIT requests instead of MAX_LIMIT, and
+        are executed CHUNK_SIZE requests at a time.
+
+        Clients can also post the name of a batch declared in the TEMPLATES setting,
+        with the parameters to fill in: `{"template": "profile", "params": {"id": 1}}`.
+
+        Batches posted with an Idempotency-Key header are executed once, retries
+        get the stored response back, and concurrent duplicates wait for it.
+
+        Add BatchRateThrottle to the throttle classes to charge every sub-request,
+        weighted by the latency of its view, instead of the batch as a whole.
+
+        When msgpack is installed, batches can be sent and received as MessagePack.
+        With COMPRESSION, responses are compressed with brotli or gzip, and HEADERS
+        can leave out or deduplicate the headers of the sub-responses.
+    """
+    permission_classes = [permissions.AllowAny]
+    renderer_classes = (
+        [BatchJSONRenderer] + list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer]
+        + OPTIONAL_RENDERERS
+    )
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + OPTIONAL_PARSERS
+
+    def post(self, *args, **kwargs):
+        renderer = self.request.accepted_renderer
+        streaming = renderer.format == NDJSONRenderer.format
+        key = get_idempotency_key(self.request)
+        if key is not None:
+            if streaming:
+                raise BadBatchRequest("Streamed batches can't have an idempotency key.")
+            (data, status_code), replayed = execute_once(
+                key, get_fingerprint(self.request.data), self.get_batch_data
+            )
+            response = Response(data, status=status_code)
+            if replayed:
+                response[REPLAYED_HEADER] = "true"
+            return response
+
+        specs = self.get_batch_specs(self.request.data, streaming)
+        if streaming:
+            return StreamingHttpResponse(
+                self.stream_responses(self.request, specs),
+                content_type=NDJSONRenderer.media_type,
+            )
+        data, status_code = self.get_batch_data(specs)
+        return Response(data, status=status_code)
+
+    def get_batch_data(self, specs=None):
+        """
+            Execute the batch and return the (data, status_code) of the response.
+        """
+        if specs is None:
+            specs = self.get_batch_specs(self.request.data)
+        # Rendered sub-response bodies can only be spliced by the batch renderers.
+        raw = (
+            batch_settings.RAW_RESPONSE_ASSEMBLY
+            and isinstance(self.request.accepted_renderer, BatchJSONRenderer)
+        )
+        responses = self.collect_responses(self.execute_batch(self.request, specs, raw=raw))
+        data = self.get_response_data(responses)
+        if raw:
+            return data, status.HTTP_200_OK
+        serializer = BatchResponseSerializer(data)
+        return serializer.data, status.HTTP_200_OK
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if batch_settings.COMPRESSION:
+            if hasattr(response, "render"):
+                response.render()
+            response = compress_response(request, response)
+        return response
+
+
+class AsyncBatchRequestView(BatchRequestMixin, View):
+    """
+        Batch view for ASGI deployments.
+
+        Sub-requests are awaited on the event loop through the async executor
+        instead of blocking a worker thread each. Like BatchRequestView, clients
+        accepting `application/x-ndjson` get a streaming response.
+
+        Sync sub-views run on a thread pool through sync_to_async, concurrently. Views
+        that rely on thread affinity, e.g. thread locals set by middleware, need
+        ASYNC_THREAD_SENSITIVE, which runs all of them on the one shared sync thread,
+        one after another.
+
+        Unlike BatchRequestView, the batch is a plain Django view: it only accepts
+        JSON, and has no DRF authentication, throttling, idempotency keys or
+        SHARE_AUTHENTICATION.
+    """
+    http_method_names = ["post", "options"]
+    renderer_class = BatchJSONRenderer
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Same as DRF views, the batch endpoint is exempt from CSRF checks.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        content = self.renderer_class().render(data)
+        return HttpResponse(
+            content, status=status_code, content_type=self.renderer_class.media_type
+        )
+
+    async def post(self, request, *args, **kwargs):
+        response = await self.handle_batch(request)
+        if batch_settings.COMPRESSION:
+            response = compress_response(request, response)
+        return response
+
+    async def handle_batch(self, request):
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError as exc:
+            return self.render(
+                {"detail": "JSON parse error - {}".format(exc)}, status.HTTP_400_BAD_REQUEST
+            )
+
+        streaming = NDJSONRenderer.media_type in request.headers.get("Accept", "")
+        try:
+            specs = self.get_batch_specs(data, streaming)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail}
+            return self.render(detail, exc.status_code)
+
+        if streaming:
+            return StreamingHttpResponse(
+                self.astream_responses(request, specs), content_type=NDJSONRenderer.media_type
             )
-        responses = batch_settings.executor.execute(requests, get_deserialized_response)
-        serializer = BatchResponseSerializer({"responses": responses})
-        return Response(serializer.data)
+        raw = batch_settings.RAW_RESPONSE_ASSEMBLY
+        responses = self.collect_responses(
+            [result async for result in self.aexecute_batch(request, specs, raw=raw)]
+        )
+        data = self.get_response_data(responses)
+        if raw:
+            return self.render(data)
+        serializer = BatchResponseSerializer(data)
+        return self.render(serializer.data)
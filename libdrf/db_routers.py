@@ -0,0 +1,149 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils.functional import SimpleLazyObject, empty
+
+from .utils import SettingsConfig
+
+DEFAULTS = {
+    'PRIMARY': 'default',
+    'REPLICAS': [],
+    'REPLICA_METHODS': ['GET', 'HEAD'],
+    'STICKY_SECONDS': 5,
+    'STICKY_CACHE': 'default',
+}
+
+config = SettingsConfig('LIBDRF_DATABASE_ROUTING', DEFAULTS)
+
+# WSGI environ key of a client id set by the application, e.g. for the sub-requests of a batch.
+CLIENT_ID_KEY = 'libdrf.client_id'
+
+_state = ContextVar('libdrf_database_routing', default=None)
+
+
+def get_client_ids(request):
+    """
+    Returns the ids of the client of a request, for stickiness: its user once it is
+    authenticated, its session and the CLIENT_ID_KEY of its environ.
+    """
+    ids = []
+    # Set by DRF once it authenticated the request, or lazily by AuthenticationMiddleware.
+    user = request.__dict__.get('user')
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        user = None
+    if user is not None and user.is_authenticated:
+        ids.append('user:{}'.format(user.pk))
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session:
+        ids.append('session:{}'.format(session))
+    client_id = request.META.get(CLIENT_ID_KEY)
+    if client_id:
+        ids.append('client:{}'.format(client_id))
+    return ids
+
+
+def get_sticky_key(client_id):
+    return 'libdrf.db_routers.sticky:{}'.format(hashlib.sha1(client_id.encode()).hexdigest())
+
+
+def is_sticky(client_ids):
+    if not client_ids:
+        return False
+    keys = [get_sticky_key(client_id) for client_id in client_ids]
+    return any(caches[config.STICKY_CACHE].get_many(keys).values())
+
+
+def make_sticky(client_ids):
+    """
+    Read from the primary for the next STICKY_SECONDS, so the client reads its own writes.
+    """
+    caches[config.STICKY_CACHE].set_many(
+        {get_sticky_key(client_id): True for client_id in client_ids}, config.STICKY_SECONDS
+    )
+
+
+class RoutingState(object):
+    """
+    How the database queries of the current request are routed.
+
+    Safe requests can read from a replica, unless the client wrote recently or the
+    request runs in a transaction on the primary that may hold uncommitted writes.
+    The client is only known once the request is authenticated, so stickiness is
+    checked again when its ids change.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self.can_use_replica = bool(
+            config.REPLICAS
+            and request.method in config.REPLICA_METHODS
+            and not connections[config.PRIMARY].in_atomic_block
+        )
+        self._sticky = {}
+        self._checking = False
+
+    def use_replica(self):
+        if not self.can_use_replica or self.wrote:
+            return False
+        if self._checking:
+            # The sticky cache itself may be stored in the database.
+            return False
+        client_ids = tuple(get_client_ids(self.request))
+        if client_ids not in self._sticky:
+            self._checking = True
+            try:
+                self._sticky[client_ids] = is_sticky(client_ids)
+            finally:
+                self._checking = False
+        return not self._sticky[client_ids]
+
+
+@contextmanager
+def route_request(request):
+    """
+    Route the reads of this request to a replica, if it can use one. Clients that
+    write to the database are made sticky to the primary.
+    """
+    state = RoutingState(request)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+        if state.wrote and config.REPLICAS:
+            client_ids = get_client_ids(request)
+            if client_ids:
+                make_sticky(client_ids)
+
+
+class ReplicaRouter(object):
+    """
+    Sends the reads of safe requests to the REPLICAS, and everything else to the
+    PRIMARY. Requests are routed with ReplicaRoutingMiddleware, batch sub-requests
+    by the batch views. Once a request writes, its remaining reads use the primary,
+    and so do the requests of its user or session for STICKY_SECONDS. Anonymous
+    clients without a session are only sticky within a batch.
+    """
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is not None and state.use_replica():
+            return random.choice(config.REPLICAS)
+        return config.PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return config.PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -8,6 +8,7 @@ from rest_framework.authentication import (BaseAuthentication,
                                            get_authorization_header)
 
 from . import models
+from .cache import token_cache
 from .settings import login_settings
 
 logger = logging.getLogger(__name__)
@@ -27,6 +28,8 @@ class JWTAuthentication(BaseAuthentication):
     `JWT_AUTH_HEADER_PREFIX`. For example:
 
         Authorization: JWT eyJhbGciOiAiSFMyNTYiLCAidHlwIj
+
+    With `JWT_CACHE_SIZE`, verified tokens are kept in the token cache.
     """
     www_authenticate_realm = 'api'
 
@@ -39,9 +42,14 @@ class JWTAuthentication(BaseAuthentication):
         if jwt_value is None:
             return None
 
+        user = token_cache.get(jwt_value)
+        if user is not None:
+            return (user, jwt_value)
+
+        generation = token_cache.generation
         try:
             payload = jwt_decode_handler(jwt_value)
-        except jwt.ExpiredSignature:
+        except jwt.ExpiredSignatureError:
             raise exceptions.AuthenticationFailed('Signature has expired.')
         except jwt.DecodeError:
             raise exceptions.AuthenticationFailed('Error decoding signature.')
@@ -49,6 +57,7 @@ class JWTAuthentication(BaseAuthentication):
             raise exceptions.AuthenticationFailed()
 
         user = self.authenticate_credentials(payload)
+        token_cache.set(jwt_value, payload, user, generation)
 
         return (user, jwt_value)
 
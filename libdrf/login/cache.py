@@ -0,0 +1,98 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from .settings import login_settings
+
+
+class TokenCache(object):
+    """
+    Bounded LRU cache of verified JWTs and their users, so authenticating a known
+    token neither decodes it nor queries the database.
+
+    Entries expire with the token, and after JWT_CACHE_TIMEOUT seconds at most.
+    They are dropped when their user is saved or deleted, e.g. by
+    invalidate_tokens(), change_password() or deactivate(), and again once the
+    transaction commits. The cache is per process, other processes keep accepting
+    the previous tokens of a user for up to JWT_CACHE_TIMEOUT seconds, which is why
+    it is disabled unless JWT_CACHE_SIZE is set.
+    """
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self._entries = OrderedDict()
+            self._users = {}
+            self.generation = 0
+
+    def get_key(self, token):
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        """
+        Returns a copy of the user authenticated by this token, or None.
+        """
+        if not self.maxsize:
+            return None
+        key = self.get_key(token)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(user)
+
+    def set(self, token, payload, user, generation):
+        """
+        Cache the user of a token verified at the given generation. Nothing is cached
+        if a user was invalidated since, the token may have been verified before that.
+        """
+        if not self.maxsize:
+            return
+        expires = time.time() + self.timeout
+        if login_settings.JWT_VERIFY_EXPIRATION and 'exp' in payload:
+            leeway = login_settings.JWT_LEEWAY
+            if isinstance(leeway, timedelta):
+                leeway = leeway.total_seconds()
+            expires = min(expires, payload['exp'] + leeway)
+        key = self.get_key(token)
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (copy.copy(user), expires)
+            self._users.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_pk):
+        """
+        Drop the cached tokens of a user.
+        """
+        with self.lock:
+            self.generation += 1
+            for key in self._users.pop(user_pk, ()):
+                self._entries.pop(key, None)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._users.get(entry[0].pk)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._users[entry[0].pk]
+
+
+token_cache = TokenCache(login_settings.JWT_CACHE_SIZE, login_settings.JWT_CACHE_TIMEOUT)
@@ -1,8 +1,15 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from . import managers
+from .cache import token_cache
+
+
+def invalidate_cached_tokens(pk):
+    token_cache.invalidate(pk)
+    # Requests may cache the previous state of the user until the change is committed.
+    transaction.on_commit(lambda: token_cache.invalidate(pk))
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -31,6 +38,16 @@ class User(AbstractBaseUser, PermissionsMixin):
             " [{}]".format(self.profile.name) if hasattr(self, 'profile') else ''
         )
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_cached_tokens(self.pk)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        invalidate_cached_tokens(pk)
+        return result
+
     def get_full_name(self):
         """
         Returns the first_name plus the last_name, with a space in between.
@@ -50,7 +67,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         self.save(update_fields=['is_active'])
 
     def deactivate(self):
-        self.is_active = True
+        self.is_active = False
         self.save(update_fields=['is_active'])
 
     def change_password(self, pw):
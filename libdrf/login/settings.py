@@ -32,6 +32,8 @@ DEFAULTS = {
     'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(days=7),
 
     'JWT_AUTH_HEADER_PREFIX': 'JWT',
+    'JWT_CACHE_SIZE': 0,
+    'JWT_CACHE_TIMEOUT': 60,
 
     'SOCIAL_AUTH_GOOGLE_CLIENT_IDS': [],
     'SOCIAL_AUTH_FACEBOOK_APP_ID': None,
@@ -1,14 +1,18 @@
 import re
+import time
 from unittest import mock
 
 from django.core import mail
 from django.test import override_settings
 from django.urls import reverse
-from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework import exceptions, status
+from rest_framework.test import APIRequestFactory, APITestCase
 from .settings import login_settings
 
 from . import factories, models
+from .authentication import JWTAuthentication
+from .cache import TokenCache, token_cache
+from .utils import jwt_encode_handler, jwt_payload_handler
 
 jwt_decode_handler = login_settings.JWT_DECODE_HANDLER
 
@@ -118,3 +122,72 @@ class RegistrationTestCase(APITestCase):
         u = models.User.objects.get(pk=payload.get('user_id'))
         self.assertFalse(u.has_usable_password())
         self.assertTrue(u.is_verified)
+
+
+@mock.patch.object(token_cache, 'maxsize', 1024)
+class JWTAuthenticationTestCase(APITestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = factories.UserFactory()
+        self.auth = 'JWT {}'.format(jwt_encode_handler(jwt_payload_handler(self.user)))
+        self.request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.auth)
+
+    def test_token_cache(self):
+        authentication = JWTAuthentication()
+        user, token = authentication.authenticate(self.request)
+        self.assertEqual(user, self.user)
+
+        # Known tokens are neither decoded nor looked up
+        with self.assertNumQueries(0), \
+                mock.patch('libdrf.login.authentication.jwt_decode_handler') as decode:
+            cached, token = authentication.authenticate(self.request)
+        decode.assert_not_called()
+        self.assertEqual(cached, self.user)
+        self.assertIsNot(cached, user)
+
+        self.user.deactivate()
+        self.assertFalse(models.User.objects.get(pk=self.user.pk).is_active)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            authentication.authenticate(self.request)
+
+        self.user.activate()
+        authentication.authenticate(self.request)
+        self.user.invalidate_tokens()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            authentication.authenticate(self.request)
+
+    def test_token_cache_commit(self):
+        authentication = JWTAuthentication()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.deactivate()
+            # Another request caches the user as it was before the commit
+            active = models.User.objects.get(pk=self.user.pk)
+            active.is_active = True
+            token_cache.set(self.auth.split()[1].encode(), {}, active, token_cache.generation)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            authentication.authenticate(self.request)
+
+    def test_token_cache_expiration(self):
+        authentication = JWTAuthentication()
+        authentication.authenticate(self.request)
+        decode = mock.patch(
+            'libdrf.login.authentication.jwt_decode_handler', wraps=login_settings.JWT_DECODE_HANDLER
+        )
+        with mock.patch('libdrf.login.cache.time.time', return_value=time.time() + 61), decode as decoded:
+            authentication.authenticate(self.request)
+        decoded.assert_called_once()
+
+    def test_token_cache_size(self):
+        cache = TokenCache(2, 60)
+        users = factories.UserFactory.create_batch(3)
+        for index, user in enumerate(users):
+            cache.set(str(index).encode(), {}, user, cache.generation)
+        self.assertIsNone(cache.get(b'0'))
+        self.assertEqual(cache.get(b'2'), users[2])
+
+        # Tokens verified before an invalidation aren't cached
+        generation = cache.generation
+        cache.invalidate(users[1].pk)
+        cache.set(b'0', {}, users[0], generation)
+        self.assertIsNone(cache.get(b'0'))
@@ -6,6 +6,8 @@ from pprint import pformat
 from django.db import connection
 from django.test import override_settings
 
+from .db_routers import route_request
+
 logger = logging.getLogger(__name__)
 
 
@@ -48,3 +50,14 @@ class LogSQLMiddleware:
             )
         )
         return response
+
+
+class ReplicaRoutingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Route the database reads of safe requests to the replicas"""
+        with route_request(request):
+            return self.get_response(request)
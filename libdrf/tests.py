@@ -0,0 +1,132 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connections
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from rest_framework import permissions, status, views
+from rest_framework.response import Response
+
+from . import db_routers
+from .batch.views import BatchRequestView
+from .login.factories import UserFactory
+from .login.models import User
+
+
+class UsersView(views.APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        return Response({'count': User.objects.count()})
+
+    def post(self, request, *args, **kwargs):
+        UserFactory(email=request.data['email'])
+        return Response({'count': User.objects.count()}, status=status.HTTP_201_CREATED)
+
+
+urlpatterns = [
+    path('batch', BatchRequestView.as_view()),
+    path('users', UsersView.as_view()),
+]
+
+
+@override_settings(
+    ROOT_URLCONF=__name__,
+    MIDDLEWARE=[
+        'libdrf.middleware.ReplicaRoutingMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+    ],
+)
+@mock.patch.object(db_routers.config, 'REPLICAS', ['replica'])
+class ReplicaRouterTestCase(TransactionTestCase):
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.router = db_routers.ReplicaRouter()
+
+    def test_route_request(self):
+        factory = RequestFactory()
+        user, other = UserFactory(), UserFactory()
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+        request = factory.get('/users')
+        with db_routers.route_request(request):
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+        with db_routers.route_request(factory.post('/users')):
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+
+        # Writes make the user sticky to the primary, once authenticated
+        request = factory.get('/users')
+        with db_routers.route_request(request):
+            request.user = user
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+        request = factory.get('/users')
+        with db_routers.route_request(request):
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+            request.user = user
+            self.assertEqual(self.router.db_for_read(User), 'default')
+        request = factory.get('/users')
+        request.user = other
+        with db_routers.route_request(request):
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+
+        # Anonymous clients without a session are never sticky
+        with db_routers.route_request(factory.post('/users')):
+            self.router.db_for_write(User)
+        with db_routers.route_request(factory.get('/users')):
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+
+    def test_middleware(self):
+        UserFactory()
+        with CaptureQueriesContext(connections['replica']) as replica:
+            resp = self.client.get('/users')
+        self.assertEqual(resp.data, {'count': 1})
+        self.assertEqual(len(replica), 1)
+
+        self.client.force_login(UserFactory())
+        with CaptureQueriesContext(connections['replica']) as replica:
+            resp = self.client.post('/users', {'email': 'a@example.com'}, content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            resp = self.client.get('/users')
+        self.assertEqual(resp.data, {'count': 3})
+        self.assertEqual(len(replica), 0)
+
+    def test_batch_sub_requests(self):
+        payload = {
+            'requests': [
+                {'method': 'get', 'path': '/users'},
+                {'method': 'post', 'path': '/users', 'body': {'email': 'a@example.com'}, 'depends_on': [0]},
+                {'method': 'get', 'path': '/users?again', 'depends_on': [1]},
+            ]
+        }
+        with CaptureQueriesContext(connections['replica']) as replica:
+            resp = self.client.post('/batch', payload, content_type='application/json')
+        bodies = [r['body'] for r in resp.json()['responses']]
+        self.assertEqual(bodies, [{'count': 0}, {'count': 1}, {'count': 1}])
+        # Only the read before the write used the replica
+        self.assertEqual(len(replica), 1)
+
+    def test_write_then_batched_read(self):
+        user, other = UserFactory(), UserFactory()
+        payload = {'requests': [{'method': 'get', 'path': '/users'}]}
+
+        self.client.force_login(user)
+        resp = self.client.post('/users', {'email': 'a@example.com'}, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            resp = self.client.post('/batch', payload, content_type='application/json')
+        self.assertEqual(resp.json()['responses'][0]['body'], {'count': 3})
+        self.assertEqual(len(replica), 0)
+
+        # Other clients still read from the replica
+        self.client.force_login(other)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            resp = self.client.post('/batch', payload, content_type='application/json')
+        self.assertEqual(resp.json()['responses'][0]['body'], {'count': 3})
+        self.assertGreater(len(replica), 0)
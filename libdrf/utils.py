@@ -1,7 +1,6 @@
 from importlib import import_module
 
 from django.conf import settings
-from django.utils import six
 
 
 def import_from_string(val, setting_name):
@@ -25,7 +24,7 @@ def perform_import(val, setting_name):
     """
     if val is None:
         return None
-    elif isinstance(val, six.string_types):
+    elif isinstance(val, str):
         return import_from_string(val, setting_name)
     elif isinstance(val, (list, tuple)):
         return [import_from_string(item, setting_name) for item in val]
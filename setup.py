@@ -20,5 +20,9 @@ setup(
         'PyJWT>=2',
         'django-rq>=0.9.5',
         'croniter>=0.3.17',
-    ]
+    ],
+    extras_require={
+        'msgpack': ['msgpack>=1'],
+        'brotli': ['brotli'],
+    },
 )
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for the construction of batch sub-requests.
+
+Compares building every item on its own (get_wsgi_request_object) with one
+BatchRequestBuilder per batch, for MAX_LIMIT sized batches.
+
+    python benchmark_batch.py [repeat]
+"""
+import os
+import sys
+import timeit
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'testproject.settings')
+
+    import django
+    django.setup()
+
+    from django.test import RequestFactory
+
+    from libdrf.batch.settings import batch_settings
+    from libdrf.batch.utils import BatchRequestBuilder, get_wsgi_request_object
+
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = batch_settings.MAX_LIMIT
+
+    parent = RequestFactory().post(
+        '/batch',
+        HTTP_USER_AGENT='benchmark',
+        HTTP_COOKIE='sessionid=abc; csrftoken=def',
+        HTTP_AUTHORIZATION='JWT token',
+    )
+    items = [
+        (
+            'post' if i % 2 else 'get',
+            '/items/{}?expand=children'.format(i),
+            {'Accept': 'application/json', 'Accept-Language': 'sv', 'X-Client-Version': '1.2.3'},
+            {'name': 'item {}'.format(i), 'tags': ['a', 'b']} if i % 2 else None,
+        )
+        for i in range(size)
+    ]
+
+    def per_item():
+        for method, path, headers, body in items:
+            get_wsgi_request_object(parent, method, path, headers, body)
+
+    def per_batch():
+        builder = BatchRequestBuilder(parent)
+        for method, path, headers, body in items:
+            builder.build(method, path, headers, body)
+
+    for name, func in [('per item', per_item), ('per batch', per_batch)]:
+        best = min(timeit.repeat(func, number=repeat, repeat=5))
+        print('{:>10}: {:6.1f} us per item ({} items per batch)'.format(
+            name, best / repeat / size * 1e6, size
+        ))